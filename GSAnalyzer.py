@@ -1,59 +1,534 @@
 import requests
+import requests.adapters
 from bs4 import BeautifulSoup as bs
 import time
 from datetime import datetime
 import pandas as pd
+import numpy as np
 import os
+import asyncio
+import csv
+import json
+import re
+import sqlite3
+import hashlib
+import socket
+import heapq
+import unicodedata
+from collections import namedtuple, Counter, defaultdict
+from contextlib import contextmanager
+from itertools import islice
+from array import array
+from queue import Queue
+from threading import Thread, Lock, RLock
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, parse_qs, parse_qsl, urlencode, urlunparse, urljoin
 
 
-def gshp_link_by_query(query):
-    # Find a researcher's Google Scholar homepage link by a query
-    kw = '+'.join(query.split())
-    search_link = 'https://scholar.google.com/citations?hl=en&view_op=search_authors&mauthors=' + kw
-    r = requests.get(search_link)
-    if r.status_code == 200:
-        soup = bs(r.content, 'html.parser')
-        if len(soup.select('.gsc_1usr')) == 1:
-            return 'https://scholar.google.com' + soup.select('.gsc_1usr')[0].find('a')['href']
-        elif len(soup.select('.gsc_1usr')) == 0:
-            print(f'No scholar was found given the input {query}')
-            return None
-        # If multiple scholars are found given the query, a manual inspection is required
-        elif len(soup.select('.gsc_1usr')) > 1:
-            print(f'More than two scholars were found given the input {query}.'
-                  f'\nSee: {search_link}')
+GS_HOST = 'https://scholar.google.com'
+# Google Scholar serves at most 100 publications per request
+GS_PAGESIZE = 100
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 '
+                  '(KHTML, like Gecko) Chrome/90.0.4430.93 Safari/537.36'
+}
+
+
+# Responses worth retrying: too many requests and server-side errors
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    # A token bucket that can be shared by threads: `rate` requests per second on average,
+    # with up to `burst` requests at once after being idle
+
+    def __init__(self, rate=1.0, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = Lock()
+
+    def reserve(self):
+        # Take a token and return how long to wait before using it
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # a token is taken even if not yet available; the wait pays it back
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+
+class Metrics:
+    """
+    Stage timers and counters of a run, e.g., requests, bytes, webdriver_calls and rows. Metrics can be
+    shared by threads (the pipeline workers), in which case the stage times are summed over the threads.
+    Every hook is called as hook(kind, name, value), with ('stage', name, seconds) when a stage ends and
+    ('count', name, n) when a counter goes up. With a path, the metrics are saved there as json (see dump)
+    after each profile generated.
+
+        metrics = Metrics(hooks=[print], path='/Users/wzx/Downloads/metrics.json')
+        g = GSAnalyzer(wd, '/Users/wzx/Downloads/', metrics=metrics)
+    """
+
+    def __init__(self, hooks=None, path=None):
+        self.hooks = list(hooks or [])
+        self.path = path
+        self.started = datetime.now()
+        self.start = time.monotonic()
+        self.stages = defaultdict(lambda: [0, 0.0])
+        self.counters = Counter()
+        self.lock = Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    @contextmanager
+    def stage(self, name):
+        # Time a block of code as the stage `name`
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        with self.lock:
+            self.stages[name][0] += 1
+            self.stages[name][1] += seconds
+        for hook in self.hooks:
+            hook('stage', name, seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+        for hook in self.hooks:
+            hook('count', name, n)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'started': self.started.isoformat(timespec='seconds'),
+                'elapsed': time.monotonic() - self.start,
+                'stages': {name: {'calls': calls, 'seconds': seconds}
+                           for name, (calls, seconds) in self.stages.items()},
+                'counters': dict(self.counters)
+            }
+
+    def dump(self, path=None):
+        # Save the metrics so far as json (to self.path by default) and return the path
+        path = path or self.path
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+        return path
+
+    def report(self):
+        metrics = self.as_dict()
+        print(f"Metrics of the run started at {metrics['started']} ({metrics['elapsed']:.2f} s):")
+        for name, stage in metrics['stages'].items():
+            print(f"  {name}: {stage['seconds']:.3f} s in {stage['calls']} call(s)")
+        for name, n in metrics['counters'].items():
+            print(f'  {name}: {n}')
+
+
+class WebDriverCounter:
+    # Wraps a selenium webdriver (and the elements it returns) to count the WebDriver calls in Metrics.
+    # Every method call and every other attribute read (e.g., page_source, element.text) is a call
+
+    def __init__(self, target, metrics):
+        self._target = target
+        self._metrics = metrics
+
+    def _wrap(self, value):
+        if isinstance(value, list):
+            return [self._wrap(v) for v in value]
+        # the web elements found
+        if hasattr(value, 'get_attribute'):
+            return WebDriverCounter(value, self._metrics)
+        return value
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            self._metrics.count('webdriver_calls')
+            return value
+
+        def call(*args, **kwargs):
+            self._metrics.count('webdriver_calls')
+            return self._wrap(value(*args, **kwargs))
+        return call
+
+
+def normalize_url(url):
+    # The same page may be asked for with its parameters in another order or with a fragment
+    parts = urlparse(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunparse((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', '', query, ''))
+
+
+class CachedResponse:
+    # A response stored in a ResponseCache
+
+    def __init__(self, key, url, status, content_type, etag, last_modified, fetched_at, ttl, content):
+        self.key = key
+        self.url = url
+        self.status = status
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+        self.ttl = ttl
+        self.content = content
+
+    @property
+    def fresh(self):
+        return time.time() - self.fetched_at < self.ttl
+
+    def validators(self):
+        # The headers of a conditional request: the server answers 304 if the page has not changed
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def response(self):
+        r = requests.Response()
+        r.status_code = self.status
+        r.url = self.url
+        r._content = self.content
+        r.headers['Content-Type'] = self.content_type or 'text/html'
+        if self.etag:
+            r.headers['ETag'] = self.etag
+        if self.last_modified:
+            r.headers['Last-Modified'] = self.last_modified
+        return r
+
+
+class ResponseCache:
+    """
+    An on-disk (SQLite) cache of the GS pages. Entries are keyed by normalized url and the page bodies are
+    stored once per content hash. Each GS endpoint, told apart by the view_op parameter, has its own TTL;
+    stale entries are revalidated with ETag/Last-Modified, and the least recently used entries are evicted
+    when the bodies take more than max_bytes. It can be shared by threads.
+    """
+    # in seconds; '' is the GS homepage itself
+    TTLS = {'': 24 * 3600, 'search_authors': 7 * 24 * 3600, 'view_citation': 7 * 24 * 3600}
+
+    def __init__(self, path, ttls=None, max_bytes=512 * 2 ** 20):
+        self.path = path
+        self.ttls = dict(self.TTLS, **(ttls or {}))
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS bodies (digest TEXT PRIMARY KEY, content BLOB, size INTEGER);
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, url TEXT, digest TEXT, status INTEGER, content_type TEXT,
+                etag TEXT, last_modified TEXT, fetched_at REAL, accessed_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+        """)
+        self.hits = self.misses = self.revalidated = self.evictions = 0
+        self.bytes_from_cache = self.bytes_from_network = 0
+
+    def ttl(self, url):
+        view_op = parse_qs(urlparse(url).query).get('view_op', [''])[0]
+        return self.ttls.get(view_op, self.ttls[''])
+
+    def lookup(self, url):
+        key = normalize_url(url)
+        with self.lock:
+            row = self.db.execute(
+                'SELECT e.status, e.content_type, e.etag, e.last_modified, e.fetched_at, b.content '
+                'FROM entries e JOIN bodies b ON e.digest = b.digest WHERE e.key = ?', (key,)
+            ).fetchone()
+        if row is None:
             return None
+        return CachedResponse(key, url, *row[:5], self.ttl(url), row[5])
+
+    def hit(self, cached):
+        # Count a fresh entry as served and return it as a response
+        with self.lock:
+            self.hits += 1
+            self.bytes_from_cache += len(cached.content)
+            with self.db:
+                self.db.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (time.time(), cached.key))
+        return cached.response()
+
+    def update(self, url, r, cached=None):
+        # Handle the network response to a (possibly conditional) request for url
+        if r.status_code == 304 and cached is not None:
+            with self.lock:
+                self.revalidated += 1
+                self.bytes_from_cache += len(cached.content)
+                now = time.time()
+                with self.db:
+                    self.db.execute('UPDATE entries SET fetched_at = ?, accessed_at = ? WHERE key = ?',
+                                    (now, now, cached.key))
+            return cached.response()
+        with self.lock:
+            self.misses += 1
+            self.bytes_from_network += len(r.content)
+        if r.status_code == 200:
+            self.store(url, r)
+        return r
+
+    def store(self, url, r):
+        digest = hashlib.sha256(r.content).hexdigest()
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute('INSERT OR IGNORE INTO bodies VALUES (?, ?, ?)', (digest, r.content, len(r.content)))
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                normalize_url(url), url, digest, r.status_code, r.headers.get('Content-Type'),
+                r.headers.get('ETag'), r.headers.get('Last-Modified'), now, now
+            ))
+            self._evict()
+
+    def _evict(self):
+        # Drop the least recently used entries (and their bodies, unless shared) until the cache fits
+        size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM bodies').fetchone()[0]
+        if size <= self.max_bytes:
+            return
+        for key, digest in self.db.execute('SELECT key, digest FROM entries ORDER BY accessed_at').fetchall():
+            self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self.evictions += 1
+            if self.db.execute('SELECT 1 FROM entries WHERE digest = ?', (digest,)).fetchone() is None:
+                size -= self.db.execute('SELECT size FROM bodies WHERE digest = ?', (digest,)).fetchone()[0]
+                self.db.execute('DELETE FROM bodies WHERE digest = ?', (digest,))
+            if size <= self.max_bytes:
+                break
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.db.execute(
+                'SELECT (SELECT COUNT(*) FROM entries), (SELECT COALESCE(SUM(size), 0) FROM bodies)'
+            ).fetchone()
+            return {
+                'hits': self.hits, 'misses': self.misses, 'revalidated': self.revalidated,
+                'evictions': self.evictions, 'bytes_from_cache': self.bytes_from_cache,
+                'bytes_from_network': self.bytes_from_network, 'entries': entries, 'size': size
+            }
+
+    def close(self):
+        self.db.close()
+
+
+def fetch(session, url, limiter=None, retries=3, backoff=1.0, timeout=30, cache=None, metrics=None):
+    # GET a url with a session, waiting for the rate limiter (if any) before each attempt.
+    # 429/5xx responses and connection errors are retried with exponential backoff,
+    # or after the Retry-After time given by the server.
+    # With a ResponseCache, fresh pages are not requested at all and stale ones are revalidated.
+    # With Metrics, the requests, retries, cache hits and bytes received are counted
+    cached = None
+    if cache is not None:
+        cached = cache.lookup(url)
+        if cached is not None and cached.fresh:
+            if metrics is not None:
+                metrics.count('cache_hits')
+            return cache.hit(cached)
+    headers = cached.validators() if cached is not None else {}
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        if metrics is not None:
+            metrics.count('requests')
+            if attempt:
+                metrics.count('retries')
+        try:
+            r = session.get(url, timeout=timeout, headers=headers)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            wait = backoff * 2 ** attempt
+        else:
+            if metrics is not None:
+                metrics.count('bytes', len(r.content))
+            if r.status_code not in RETRY_STATUS or attempt == retries:
+                return r if cache is None else cache.update(url, r, cached)
+            retry_after = r.headers.get('Retry-After', '')
+            wait = int(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt
+        time.sleep(wait)
+
+
+def gs_session(pool_size=10):
+    # A requests.Session keeping up to pool_size connections alive per host, to be shared by threads
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# A scholar found by a GS author search
+AuthorCandidate = namedtuple('AuthorCandidate', ['url', 'name', 'affiliation', 'email', 'interests', 'cited_by'])
+
+
+def parse_author_search(soup, base_url=GS_HOST):
+    # The scholars listed on a GS author search page, parsed in one pass
+    candidates = []
+    for usr in soup.select('.gsc_1usr'):
+        link = usr.select_one('.gs_ai_name a') or usr.find('a')
+        cited_by = re.findall(r'\d+', visible_text(usr.select_one('.gs_ai_cby')))
+        candidates.append(AuthorCandidate(
+            urljoin(base_url, link['href']),
+            visible_text(link),
+            visible_text(usr.select_one('.gs_ai_aff')),
+            visible_text(usr.select_one('.gs_ai_eml')),
+            [visible_text(a) for a in usr.select('.gs_ai_int a')],
+            int(cited_by[0]) if cited_by else 0
+        ))
+    return candidates
+
+
+def search_gs_authors(query, session=None, limiter=None, retries=0, cache=None, host=GS_HOST, metrics=None):
+    # Search GS for the authors matching a query. Return the search link and the AuthorCandidates found
+    kw = '+'.join(query.split())
+    search_link = host + '/citations?hl=en&view_op=search_authors&mauthors=' + kw
+    r = fetch(session or requests, search_link, limiter=limiter, retries=retries, cache=cache, metrics=metrics)
+    r.raise_for_status()
+    return search_link, parse_author_search(bs(r.content, 'html.parser'), search_link)
+
+
+def gshp_link_by_query(query, session=None, limiter=None, retries=0, cache=None):
+    # Find a researcher's Google Scholar homepage link by a query
+    try:
+        search_link, candidates = search_gs_authors(query, session=session, limiter=limiter, retries=retries,
+                                                    cache=cache)
+    except requests.HTTPError as e:
+        print(f"A bad request. {e.response.status_code} Client Error.")
+        return None
+    if len(candidates) == 1:
+        return candidates[0].url
+    elif len(candidates) == 0:
+        print(f'No scholar was found given the input {query}')
+        return None
+    # If multiple scholars are found given the query, a manual inspection is required
     else:
-        print(f"A bad request. {r.status_code} Client Error.")
+        print(f'More than two scholars were found given the input {query}.'
+              f'\nSee: {search_link}')
         return None
 
 
+# The outcome of resolving a query with AuthorResolver: status is 'resolved', 'known' (resolved before),
+# 'ambiguous', 'not found' or 'error'; url is None unless resolved or known
+Resolution = namedtuple('Resolution', ['query', 'url', 'status', 'candidates'])
+
+
+class AuthorResolver:
+    """
+    Resolve many names to GS homepages at once. The searches share a pooled session and run on `workers`
+    threads. When several scholars are found, they are scored by how well their affiliation, email domain and
+    interests match the hint given with the name (and by whether their name matches), and the best one is
+    picked if it clearly stands out. With a GSDatabase, the resolutions are saved so that repeat lookups
+    need no request.
+
+        resolver = AuthorResolver(database=GSDatabase('GS Database.sqlite'))
+        resolver.resolve(['Claude E Shannon', ('Ronald A. Fisher', 'University College London')])
+    """
+
+    def __init__(self, session=None, database=None, limiter=None, retries=3, cache=None, workers=4,
+                 margin=0.5, host=GS_HOST, metrics=None):
+        self.own_session = session is None
+        self.session = session or gs_session(workers)
+        self.database = database
+        self.limiter = limiter
+        self.retries = retries
+        self.cache = cache
+        self.workers = workers
+        self.margin = margin
+        self.host = host
+        self.metrics = metrics
+
+    @staticmethod
+    def query_key(name, hint=''):
+        return ' '.join(name.lower().split()) + '|' + ' '.join((hint or '').lower().split())
+
+    @staticmethod
+    def score(candidate, name, hint=''):
+        key = author_key(name)
+        score = 1.0 if key is not None and author_key(candidate.name) == key else 0.0
+        hint_tokens = set(re.findall(r'\w+', (hint or '').lower())) - STOPWORDS
+        if hint_tokens:
+            text = ' '.join([candidate.affiliation, candidate.email] + candidate.interests).lower()
+            score += 2 * len(hint_tokens & set(re.findall(r'\w+', text))) / len(hint_tokens)
+        return score
+
+    def pick(self, candidates, name, hint=''):
+        # The candidate that clearly scores best, if any
+        if len(candidates) == 1:
+            return candidates[0]
+        scores = sorted(((self.score(c, name, hint), i) for i, c in enumerate(candidates)), reverse=True)
+        if scores and scores[0][0] > 0 and (len(scores) == 1 or scores[0][0] - scores[1][0] >= self.margin):
+            return candidates[scores[0][1]]
+        return None
+
+    def resolve_one(self, query):
+        # query is a name, or a (name, hint) pair where the hint is, e.g., an affiliation
+        name, hint = (query, '') if isinstance(query, str) else query
+        key = self.query_key(name, hint)
+        if self.database is not None:
+            url = self.database.resolution(key)
+            if url is not None:
+                return Resolution(query, url, 'known', [])
+        try:
+            _, candidates = search_gs_authors(name, session=self.session, limiter=self.limiter,
+                                              retries=self.retries, cache=self.cache, host=self.host,
+                                              metrics=self.metrics)
+        except Exception as e:
+            return Resolution(query, None, 'error', [e])
+        if not candidates:
+            return Resolution(query, None, 'not found', [])
+        best = self.pick(candidates, name, hint)
+        if best is None:
+            return Resolution(query, None, 'ambiguous', candidates)
+        if self.database is not None:
+            self.database.save_resolution(key, best.url)
+        return Resolution(query, best.url, 'resolved', candidates)
+
+    def resolve(self, queries):
+        # A Resolution per query, in the order of the queries
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(self.resolve_one, queries))
+
+    def close(self):
+        # the session given is left open
+        if self.own_session:
+            self.session.close()
+
+
+STOPWORDS = frozenset([
+    'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', "you're",
+    "you've", "you'll", "you'd", 'your', 'yours', 'yourself', 'yourselves', 'he', 'him', 'his',
+    'himself', 'she', "she's", 'her', 'hers', 'herself', 'it', "it's", 'its', 'itself', 'they', 'them',
+    'their', 'theirs', 'themselves', 'what', 'which', 'who', 'whom', 'this', 'that', "that'll", 'these',
+    'those', 'am', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'having', 'do',
+    'does', 'did', 'doing', 'a', 'an', 'the', 'and', 'but', 'if', 'or', 'because', 'as', 'until', 'while',
+    'of', 'at', 'by', 'for', 'with', 'about', 'against', 'between', 'into', 'through', 'during', 'before',
+    'after', 'above', 'below', 'to', 'from', 'up', 'down', 'in', 'out', 'on', 'off', 'over', 'under',
+    'again', 'further', 'then', 'once', 'here', 'there', 'when', 'where', 'why', 'how', 'all', 'any',
+    'both', 'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor', 'not', 'only', 'own',
+    'same', 'so', 'than', 'too', 'very', 'can', 'cannot', 'will', 'just', "don't", 'should', "should've",
+    'now', "aren't", "couldn't", "didn't", "doesn't", "hadn't", "hasn't", "haven't", "isn't", "mightn't",
+    "mustn't", "needn't", "shan't", "shouldn't", "wasn't", "weren't", "won't", "wouldn't"
+])
+
+
 def spw_filter(string):
     """Filter stopwords in a given string --> Titles of researchers' publications"""
-    stopwords = ['i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', "you're",
-                 "you've", "you'll", "you'd", 'your', 'yours', 'yourself', 'yourselves', 'he', 'him', 'his',
-                 'himself', 'she', "she's", 'her', 'hers', 'herself', 'it', "it's", 'its', 'itself', 'they', 'them',
-                 'their', 'theirs', 'themselves', 'what', 'which', 'who', 'whom', 'this', 'that', "that'll", 'these',
-                 'those', 'am', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'having', 'do',
-                 'does', 'did', 'doing', 'a', 'an', 'the', 'and', 'but', 'if', 'or', 'because', 'as', 'until', 'while',
-                 'of', 'at', 'by', 'for', 'with', 'about', 'against', 'between', 'into', 'through', 'during', 'before',
-                 'after', 'above', 'below', 'to', 'from', 'up', 'down', 'in', 'out', 'on', 'off', 'over', 'under',
-                 'again', 'further', 'then', 'once', 'here', 'there', 'when', 'where', 'why', 'how', 'all', 'any',
-                 'both', 'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor', 'not', 'only', 'own',
-                 'same', 'so', 'than', 'too', 'very', 'can', 'cannot', 'will', 'just', "don't", 'should', "should've",
-                 'now', "aren't", "couldn't", "didn't", "doesn't", "hadn't", "hasn't", "haven't", "isn't", "mightn't",
-                 "mustn't", "needn't", "shan't", "shouldn't", "wasn't", "weren't", "won't", "wouldn't"]
-
-    return [tk.strip() for tk in string.lower().split() if tk not in stopwords]
+    return [tk.strip() for tk in string.lower().split() if tk not in STOPWORDS]
 
 
 def ngram(tokens, n):
-    start = 0
-    end = len(tokens) - n + 1
-    res = []
-    for i in range(start, end):
-        res.append(' '.join(tokens[i:i+n]))
-    return res
+    return [' '.join(gram) for gram in zip(*[tokens[i:] for i in range(n)])]
 
 
 def filtered_ngram(list_of_str, n):
@@ -71,220 +546,2205 @@ def filtered_ngram(list_of_str, n):
 
 
 def counter(alist, most_common=None):
-    if not type(alist) is list:
-        alist = list(alist)
-    else:
+    # The items by frequency, the most frequent first. Items equally frequent keep the order they first appear in
+    counts = Counter(alist)
+    if most_common is None:
+        return sorted(counts.items(), key=lambda x: x[1], reverse=True)
+    # only the top items are kept in a heap instead of sorting them all
+    return heapq.nlargest(most_common, counts.items(), key=lambda x: x[1])
+
+
+class NgramEngine:
+    """
+    N-gram statistics over the titles of one or many scholars. The tokens are mapped to integer ids once,
+    and the n-grams of every scholar are counted together with NumPy, for any n.
+
+        engine = NgramEngine()
+        engine.add('Fisher', titles)
+        engine.most_common(range(1, 4), k=20)      # {1: [(unigram, count), ...], 2: [...], 3: [...]}
+        engine.tfidf(2, k=10)                      # {scholar: [(bigram, tf-idf), ...]}
+    """
+
+    def __init__(self, stopwords=STOPWORDS):
+        self.stopwords = stopwords
+        self.vocab = {}
+        self.tokens = []
+        self.scholars = {}
+        # the token ids of each scholar's titles; every title ends with -1, so no n-gram spans two titles
+        self.ids = []
+
+    def tokenize(self, titles):
+        ids = []
+        for title in titles:
+            for tk in title.lower().split():
+                if tk in self.stopwords:
+                    continue
+                i = self.vocab.get(tk)
+                if i is None:
+                    i = self.vocab[tk] = len(self.tokens)
+                    self.tokens.append(tk)
+                ids.append(i)
+            ids.append(-1)
+        return np.array(ids, dtype=np.int64)
+
+    def add(self, scholar, titles):
+        # Add the titles of a scholar (to those already added, if any)
+        ids = self.tokenize(titles)
+        if scholar in self.scholars:
+            i = self.scholars[scholar]
+            self.ids[i] = np.concatenate([self.ids[i], ids])
+        else:
+            self.scholars[scholar] = len(self.ids)
+            self.ids.append(ids)
+
+    def grams(self, n, scholars=None):
+        # The n-grams of the given scholars (all by default) as (owners, gram keys, first windows):
+        # the scholar index of every n-gram, an integer key per distinct n-gram, and one window of token ids per key
+        which = list(range(len(self.ids))) if scholars is None else [self.scholars[s] for s in scholars]
+        if not which:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty((0, n), np.int64)
+        ids = np.concatenate([self.ids[i] for i in which])
+        owners = np.repeat(np.array(which, dtype=np.int64), [len(self.ids[i]) for i in which])
+        if len(ids) < n:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty((0, n), np.int64)
+        windows = np.lib.stride_tricks.sliding_window_view(ids, n)
+        valid = (windows >= 0).all(axis=1)
+        windows, owners = windows[valid], owners[:len(valid)][valid]
+        base = max(len(self.tokens), 1)
+        if base ** n < 2 ** 62:
+            keys = windows @ (base ** np.arange(n - 1, -1, -1, dtype=np.int64))
+        else:
+            # too many distinct tokens to encode an n-gram in one int64
+            keys = np.unique(windows, axis=0, return_inverse=True)[1].reshape(-1)
+        return owners, keys, windows
+
+    def decode(self, window):
+        return ' '.join(self.tokens[i] for i in window)
+
+    def counts(self, n, scholars=None):
+        # (n-gram, count) of every distinct n-gram, in the order they first appear
+        _, keys, windows = self.grams(n, scholars)
+        uniq, first, counts = np.unique(keys, return_index=True, return_counts=True)
+        order = np.argsort(first, kind='stable')
+        return [(self.decode(windows[first[i]]), int(counts[i])) for i in order]
+
+    def most_common(self, ns=1, k=20, scholars=None):
+        # The k most frequent n-grams for n (or each n in ns): the same ranking as counter().
+        # Return a list for a single n, a dict {n: list} otherwise
+        if isinstance(ns, int):
+            return self._most_common(ns, k, scholars)
+        return {n: self._most_common(n, k, scholars) for n in ns}
+
+    def _most_common(self, n, k, scholars):
+        # nothing is asked for, like counter(..., 0)
+        if k is not None and k <= 0:
+            return []
+        _, keys, windows = self.grams(n, scholars)
+        if not len(keys):
+            return []
+        uniq, first, counts = np.unique(keys, return_index=True, return_counts=True)
+        top = np.arange(len(uniq))
+        if k is not None and k < len(uniq):
+            # partial selection of the candidates before sorting them
+            threshold = np.partition(counts, len(counts) - k)[len(counts) - k]
+            top = np.flatnonzero(counts >= threshold)
+        top = top[np.lexsort((first[top], -counts[top]))][:k]
+        return [(self.decode(windows[first[i]]), int(counts[i])) for i in top]
+
+    def tfidf(self, n=1, k=20):
+        # The k n-grams with the highest tf-idf of each scholar, where every scholar's titles are one document
+        owners, keys, windows = self.grams(n)
+        names = list(self.scholars)
+        if not len(keys):
+            return {name: [] for name in names}
+        uniq, first, gram = np.unique(keys, return_index=True, return_inverse=True)
+        gram = gram.reshape(-1)
+        pairs, counts = np.unique(owners * len(uniq) + gram, return_counts=True)
+        pair_owner, pair_gram = pairs // len(uniq), pairs % len(uniq)
+        df = np.bincount(pair_gram, minlength=len(uniq))
+        idf = np.log((1 + len(names)) / (1 + df)) + 1
+        totals = np.bincount(pair_owner, weights=counts, minlength=len(names))
+        scores = counts / totals[pair_owner] * idf[pair_gram]
+        order = np.lexsort((first[pair_gram], -scores, pair_owner))
+        res = {name: [] for name in names}
+        for i in order:
+            top = res[names[pair_owner[i]]]
+            if k is None or len(top) < k:
+                top.append((self.decode(windows[first[pair_gram[i]]]), float(scores[i])))
+        return res
+
+
+def titles_ngram_analysis(titles, n_gram=2, most_used=20):
+    # Return unigram and specified ngram analysis of the titles.
+    # The titles are tokenized once by NgramEngine, which ranks the n-grams like counter(filtered_ngram(...))
+    engine = NgramEngine()
+    engine.add(None, titles)
+    fdist_ug = engine.most_common(1, most_used)
+    fdist_ng = engine.most_common(n_gram, most_used)
+    if len(fdist_ng) < len(fdist_ug):
+        for i in range(len(fdist_ug) - len(fdist_ng)):
+            fdist_ng.append(('', ''))
+    splitter = [''] * len(fdist_ug)
+
+    return zip(fdist_ug, splitter, fdist_ng)
+
+
+def num_of_pub_by_year(years):
+    # Return the number of publication each year. The years can be strings as GS shows them, or integers
+    # (0 when GS shows none, see PublicationTable)
+    years = [str(y) if y else '' for y in years]
+    return counter(years)
+
+
+def author_key(name):
+    # A normalized key for an author name: the last name and the first initial, e.g., 'fisher r'
+    # for 'RA Fisher', 'R. A. Fisher' or 'Ronald A. Fisher'. The names without Latin letters (e.g., '王小明')
+    # are kept whole, casefolded. None for '...' (more authors, not shown by GS)
+    folded = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    tokens = re.sub(r"[^a-z\s-]", '', folded.lower().replace('.', ' ')).split()
+    if not tokens:
+        name = ' '.join(name.casefold().split())
+        return name if any(c.isalpha() for c in name) else None
+    return f'{tokens[-1]} {tokens[0][0]}' if len(tokens) > 1 else tokens[0]
+
+
+def authors_analysis(authors, gs_name):
+    # 1. The contribution of the researcher of interest to the publications that he/she authored.
+    # The contribution is intuitively displayed as the frequency of the author ranks the researcher was in.
+    # 2. The list of co-author, including the researcher him/herself.
+    # The author(s) of each publication are a string as GS shows them ('RA Fisher, F Yates') or a list of names
+    auth_list = []
+    key = author_key(gs_name)
+    # author_key is computed once per distinct name
+    match = {}
+    contribution_index = []
+    n_pubs = 0
+
+    for au in authors:
+        l = [a.strip() for a in au.split(',')] if isinstance(au, str) else au
+        auth_list.extend(l)
+        # the researcher is matched by name key, not by a substring of the last name (e.g., Li in Lin)
+        ranks = []
+        for i, a in enumerate(l, 1):
+            m = match.get(a)
+            if m is None:
+                m = match[a] = key is not None and author_key(a) == key
+            if m:
+                ranks.append(i)
+        contribution_index.extend(ranks or ['N/A'])
+        n_pubs += 1
+
+    ctr_fdist = counter(contribution_index)
+    ctr_fdist = [('Which author', 'Count')] + [('#_' + str(i), j) for i, j in ctr_fdist]
+    ctr_fdist += [('# of Pubs', n_pubs), ('', ''), ('Author', 'Count')]
+    auth_fdist = counter(auth_list)
+
+    return ctr_fdist + auth_fdist
+
+
+class PublicationTable:
+    """
+    The publications of one profile, in columns. The citations and years are parsed once into integer arrays
+    (-1 and 0 when GS shows none). The author names, the sources and the common beginning of the links are
+    interned: each distinct string is kept once in `strings` and the publications refer to it by number.
+    The titles and the rest of the links are utf-8 encoded one after the other in `text`.
+    The authors of the i-th publication are author_ids[author_ptr[i]:author_ptr[i + 1]].
+    The table is also a sequence of (title, link, author(s), citation, year, source) rows as GS shows them
+    (the authors being joined with ', '), so it can be saved like the rows of parse_publication_rows.
+    """
+    __slots__ = ('text', 'text_ptr', 'link_ids', 'citations', 'starred', 'years', 'strings', 'author_ids',
+                 'author_ptr', 'source_ids')
+
+    def __init__(self, rows=()):
+        # the title of the i-th publication is text[text_ptr[2i]:text_ptr[2i + 1]], the end of its link follows
+        self.text, self.text_ptr, self.link_ids = bytearray(), array('q', [0]), array('i')
+        # GS marks with * the citations that may include other articles merged into the publication
+        self.citations, self.starred, self.years = array('i'), bytearray(), array('h')
+        self.strings = []
+        self.author_ids, self.author_ptr, self.source_ids = array('i'), array('i', [0]), array('i')
+        ids = {}
+
+        def intern(string):
+            i = ids.get(string)
+            if i is None:
+                i = ids[string] = len(self.strings)
+                self.strings.append(string)
+            return i
+
+        for title, link, authors, citation, year, source in rows:
+            # e.g., .../citations?view_op=view_citation&hl=en&user=2M6S-aAAAAAJ&citation_for_view= + 2M6S-aAAAAAJ:u5HHmVD_uO8C
+            start, sep, end = link.rpartition('=')
+            self.link_ids.append(intern(start + sep))
+            for string in (title, end):
+                self.text += string.encode()
+                self.text_ptr.append(len(self.text))
+            self.author_ids.extend(intern(a.strip()) for a in authors.split(','))
+            self.author_ptr.append(len(self.author_ids))
+            # e.g., '26480*', or '26480\n*' as the browser shows it
+            match = re.fullmatch(r'(\d+)\s*(\*?)', str(citation).strip())
+            self.citations.append(int(match[1]) if match else -1)
+            self.starred.append(bool(match and match[2]))
+            year = str(year).strip()
+            self.years.append(int(year) if year.isdigit() else 0)
+            self.source_ids.append(intern(source))
+
+    def __len__(self):
+        return len(self.link_ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        citation, year = self.citations[i], self.years[i]
+        return (
+            self.title(i),
+            self.link(i),
+            ', '.join(self.authors(i)),
+            '' if citation < 0 else str(citation) + '*' * self.starred[i],
+            str(year) if year else '',
+            self.strings[self.source_ids[i]]
+        )
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def title(self, i):
+        return self.text[self.text_ptr[2 * i]:self.text_ptr[2 * i + 1]].decode()
+
+    def link(self, i):
+        return self.strings[self.link_ids[i]] + self.text[self.text_ptr[2 * i + 1]:self.text_ptr[2 * i + 2]].decode()
+
+    @property
+    def titles(self):
+        return [self.title(i) for i in range(len(self))]
+
+    def authors(self, i):
+        return [self.strings[a] for a in self.author_ids[self.author_ptr[i]:self.author_ptr[i + 1]]]
+
+    def titles_ngram_analysis(self, n_gram=2, most_used=20):
+        return titles_ngram_analysis(self.titles, n_gram, most_used)
+
+    def num_of_pub_by_year(self):
+        return num_of_pub_by_year(self.years)
+
+    def authors_analysis(self, gs_name):
+        return authors_analysis((self.authors(i) for i in range(len(self))), gs_name)
+
+
+BASIC_INFO_COLUMNS = [
+    'Name', 'Affiliation', 'Homepage', 'GScholarUrl', 'Specialization',
+    'Citation(All)', 'Citation(Past 5 Year)', 'Date Recorded'
+]
+
+
+def profile_sheets(profile, n_gram=2, most_used=20):
+    # The sheets of a GS profile workbook, given the profile extracted by GSAnalyzer.extract_profile,
+    # as (sheet name, header or None, rows, whether the first column is an index) in the order they are saved.
+    # The publications are not copied: their rows are produced while being written
+    info = profile['info']
+    publications = profile['publications']
+    table = publications if isinstance(publications, PublicationTable) else PublicationTable(publications)
+    return [
+        ('Basic Info', None, [list(row) for row in zip(BASIC_INFO_COLUMNS, info)], True),
+        ('Citation by Year', ['Year', 'Citation'], profile['citation_by_year'], False),
+        ('Publication Info', ['Title', 'Link', 'Author', 'Citation', 'Year', 'Source'], publications, False),
+        # the (n-gram, count) pairs are shown as such, as they always have been
+        ('Titles Ngram', ['Unigram', '', f'{n_gram}-gram'],
+         [[str(ug), sp, str(ng)] for ug, sp, ng in table.titles_ngram_analysis(n_gram, most_used)], False),
+        ('Pub Num by Year', ['Year', 'Count'], table.num_of_pub_by_year(), False),
+        ('Authors Analysis', None, table.authors_analysis(info[0]), False)
+    ] + ([('Publication Details',
+           ['Title', 'Link', 'Authors', 'Date', 'Source', 'Abstract', 'Citation', 'Citation by Year'],
+           ([title, link, ', '.join(authors), date, source, abstract, citations,
+             '; '.join(f'{y}: {c}' for y, c in by_year)]
+            for link, title, authors, date, source, abstract, citations, by_year in filter(None, profile['details'])),
+           False)] if profile.get('details') else [])
+
+
+class XlsxSink:
+    # An xlsx workbook written row by row in constant memory (openpyxl's write-only mode),
+    # with the headers (and the index) styled like pandas does
+
+    ext = '.xlsx'
+
+    def __init__(self, path):
+        from openpyxl import Workbook
+        from openpyxl.styles import Alignment, Border, Font, Side
+        self.path = path
+        self.wb = Workbook(write_only=True)
+        side = Side(style='thin')
+        self.font = Font(bold=True)
+        self.border = Border(left=side, right=side, top=side, bottom=side)
+        self.alignment = Alignment(horizontal='center', vertical='top')
+
+    def header_cell(self, ws, value):
+        from openpyxl.cell import WriteOnlyCell
+        cell = WriteOnlyCell(ws, value=value if value != '' else None)
+        cell.font, cell.border, cell.alignment = self.font, self.border, self.alignment
+        return cell
+
+    def write_sheet(self, name, header, rows, index=False):
+        ws = self.wb.create_sheet(name)
+        if header is not None:
+            ws.append([self.header_cell(ws, h) for h in header])
+        for row in rows:
+            row = [v if v != '' else None for v in row]
+            if index:
+                row[0] = self.header_cell(ws, row[0])
+            ws.append(row)
+
+    def close(self):
+        self.wb.save(self.path)
+
+
+class CsvSink:
+    # A directory with a csv file per sheet
+
+    ext = ''
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write_sheet(self, name, header, rows, index=False):
+        with open(os.path.join(self.path, name + '.csv'), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if header is not None:
+                writer.writerow(header)
+            writer.writerows(rows)
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    # A single JSON Lines file: {"sheet": ..., "header": [...]} then {"sheet": ..., "row": [...]} per row
+
+    ext = '.jsonl'
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'w', encoding='utf-8')
+
+    def write_sheet(self, name, header, rows, index=False):
+        if header is not None:
+            self.f.write(json.dumps({'sheet': name, 'header': header}, ensure_ascii=False) + '\n')
+        for row in rows:
+            self.f.write(json.dumps({'sheet': name, 'row': list(row)}, ensure_ascii=False) + '\n')
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetSink:
+    # A directory with a parquet file per sheet (needs pyarrow). All the values are saved as strings,
+    # since the columns of the sheets are not typed. The rows are written in batches of batch_size
+
+    ext = ''
+
+    def __init__(self, path, batch_size=10000):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.batch_size = batch_size
+        os.makedirs(path, exist_ok=True)
+
+    def write_sheet(self, name, header, rows, index=False):
+        rows = iter(rows)
+        batch = list(islice(rows, self.batch_size))
+        if header is None:
+            header = [str(i) for i in range(len(batch[0]))] if batch else []
+        schema = self.pa.schema([(col, self.pa.string()) for col in header])
+        with self.pq.ParquetWriter(os.path.join(self.path, name + '.parquet'), schema) as writer:
+            while True:
+                writer.write_table(self.pa.table(
+                    {col: [None if row[i] is None else str(row[i]) for row in batch] for i, col in enumerate(header)},
+                    schema=schema
+                ))
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+
+    def close(self):
         pass
-    counts = dict()
-    for i in alist:
-        counts[i] = counts.get(i, 0) + 1
 
-    return sorted(counts.items(), key=lambda x: x[1], reverse=True)[:most_common]
+
+SINKS = {'xlsx': XlsxSink, 'csv': CsvSink, 'jsonl': JsonLinesSink, 'parquet': ParquetSink}
+
+
+def gs_profile_path(res_dir, gs_name, date, ext='.xlsx'):
+    return f'{res_dir}{gs_name} GSProfile_{date}{ext}'
+
+
+def write_gs_profile(res_dir, profile, sheets, output='xlsx'):
+    # Save the sheets made by profile_sheets as the researcher's GS profile, streaming the rows to the output:
+    # 'xlsx' (the workbook), 'csv', 'jsonl' or 'parquet', or a sink class like the ones in SINKS
+    sink_class = SINKS[output] if isinstance(output, str) else output
+    name, date = profile['info'][0], profile['info'][-1]
+    path = gs_profile_path(res_dir, name, date, sink_class.ext)
+    sink = sink_class(path)
+    try:
+        for sheet_name, header, rows, index in sheets:
+            sink.write_sheet(sheet_name, header, rows, index=index)
+    finally:
+        sink.close()
+    print(f'File {path} saved!')
+    return path
+
+
+def gs_user_id(url):
+    # The user id of a GS homepage, e.g., '2M6S-aAAAAAJ' for .../citations?user=2M6S-aAAAAAJ&hl=en
+    return parse_qs(urlparse(url).query).get('user', [None])[0]
+
+
+def merge_publications(fetched, snapshot, recent=()):
+    # The freshly fetched publications come first (they are up to date), followed by the recent publications
+    # (see GSAnalyzer.recent_publications) and the ones in the snapshot that were not fetched again,
+    # ordered by citations like on GS
+    links = {row[1] for row in fetched}
+    rest = [row for row in recent if row[1] not in links]
+    links.update(row[1] for row in rest)
+    rest += [row for row in snapshot if row[1] not in links]
+    order = np.argsort(-to_ints([row[3] for row in rest]), kind='stable')
+    return list(fetched) + [rest[i] for i in order]
+
+
+# The default database file in the output directory
+GS_DATABASE = 'GS Database.sqlite'
+
+
+class GSDatabase:
+    """
+    A SQLite database of the scraped profiles: the basic info of every scholar (keyed by GS url),
+    the publications of every scholar as of the last run (keyed by the user id in the GS url),
+    and how their citations changed between runs.
+    It can be shared by threads, and by processes thanks to the WAL journal: every write is a transaction.
+    WAL needs the processes to be on the same machine, though: for a database shared by several machines
+    (e.g., on a network filesystem, see JobQueue), use journal_mode='DELETE', the rollback journal.
+    """
+
+    def __init__(self, path, journal_mode='WAL'):
+        self.path = path
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute(f'PRAGMA journal_mode={journal_mode}')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS scholars (
+                url TEXT PRIMARY KEY, name TEXT, affiliation TEXT, homepage TEXT, specialization TEXT,
+                citation_all TEXT, citation_5y TEXT, date TEXT
+            );
+            CREATE TABLE IF NOT EXISTS snapshots (
+                user TEXT PRIMARY KEY, url TEXT, name TEXT, date TEXT, n_pubs INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS publications (
+                user TEXT, link TEXT, position INTEGER, title TEXT, authors TEXT, citations TEXT,
+                year TEXT, source TEXT, first_seen TEXT, last_seen TEXT, author_position INTEGER,
+                PRIMARY KEY (user, link)
+            );
+            CREATE TABLE IF NOT EXISTS citation_history (
+                user TEXT, link TEXT, date TEXT, citations TEXT, PRIMARY KEY (user, link, date)
+            );
+            CREATE TABLE IF NOT EXISTS citations_by_year (
+                user TEXT, year INTEGER, citations INTEGER, PRIMARY KEY (user, year)
+            );
+            CREATE TABLE IF NOT EXISTS authorships (
+                pub TEXT, position INTEGER, name TEXT, PRIMARY KEY (pub, position)
+            );
+            CREATE TABLE IF NOT EXISTS scholar_authors (user TEXT PRIMARY KEY, key TEXT, name TEXT);
+            CREATE TABLE IF NOT EXISTS resolutions (query TEXT PRIMARY KEY, user TEXT, url TEXT, date TEXT);
+            CREATE TABLE IF NOT EXISTS publication_details (
+                link TEXT PRIMARY KEY, user TEXT, title TEXT, authors TEXT, date TEXT, source TEXT, abstract TEXT,
+                citations INTEGER, crawled TEXT
+            );
+            CREATE INDEX IF NOT EXISTS publication_details_user ON publication_details (user);
+            CREATE TABLE IF NOT EXISTS publication_citations (
+                link TEXT, year INTEGER, citations INTEGER, PRIMARY KEY (link, year)
+            );
+        """)
+        # the databases made before the scholar's position among the authors was stored (see author_position)
+        if 'author_position' not in [row[1] for row in self.db.execute('PRAGMA table_info(publications)')]:
+            self.db.execute('ALTER TABLE publications ADD COLUMN author_position INTEGER')
+        # what a Cohort reads, without the wide rows of the publications
+        self.db.execute('CREATE INDEX IF NOT EXISTS publications_cohort '
+                        'ON publications (user, citations, year, author_position)')
+
+    def upsert_scholar(self, info):
+        # Add (or update if the GS url is already there) the basic info of a scholar.
+        # Return True if the scholar is new
+        name, affiliation, homepage, url, specialization, citation_all, citation_5y, date = info
+        with self.lock, self.db:
+            new = self.db.execute('SELECT 1 FROM scholars WHERE url = ?', (url,)).fetchone() is None
+            self.db.execute(
+                'INSERT INTO scholars VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET '
+                'name = excluded.name, affiliation = excluded.affiliation, homepage = excluded.homepage, '
+                'specialization = excluded.specialization, citation_all = excluded.citation_all, '
+                'citation_5y = excluded.citation_5y, date = excluded.date',
+                (url, name, affiliation, homepage, specialization, citation_all, citation_5y, date)
+            )
+        return new
+
+    def scholars(self):
+        # The basic info of every scholar, in the column order of BASIC_INFO_COLUMNS
+        with self.lock:
+            return self.db.execute(
+                'SELECT name, affiliation, homepage, url, specialization, citation_all, citation_5y, date '
+                'FROM scholars ORDER BY rowid'
+            ).fetchall()
+
+    def export_excel(self, path):
+        # Save the basic info of every scholar as an excel file like the former Aggregated GS Database
+        pd.DataFrame(self.scholars(), columns=BASIC_INFO_COLUMNS).to_excel(path, index=False)
+        print(f'File {path} saved!')
+
+    def import_excel(self, path):
+        # Load an Aggregated GS Database excel file made by an earlier version of this program
+        for info in pd.read_excel(path, dtype=str).fillna('').itertuples(index=False):
+            self.upsert_scholar(list(info))
+
+    def snapshot(self, user):
+        # The publications of a scholar as of the last run, in the order of the GS homepage
+        with self.lock:
+            return self.db.execute(
+                'SELECT title, link, authors, citations, year, source FROM publications '
+                'WHERE user = ? ORDER BY position', (user,)
+            ).fetchall()
+
+    def save_snapshot(self, profile):
+        # Store the profile extracted by GSAnalyzer.extract_profile as the scholar's latest snapshot.
+        # A citation count is added to the history whenever it differs from the stored one.
+        # The scholar's position among the authors of every publication is stored for Cohort
+        info = profile['info']
+        user = gs_user_id(info[3])
+        date = info[-1]
+        key, keys = author_key(info[0]), {}
+        with self.lock, self.db:
+            known = dict(self.db.execute('SELECT link, citations FROM publications WHERE user = ?', (user,)))
+            # publications removed from the homepage since the last run
+            links = {row[1] for row in profile['publications']}
+            self.db.executemany('DELETE FROM publications WHERE user = ? AND link = ?',
+                                [(user, link) for link in known if link not in links])
+            for position, (title, link, authors, citations, year, source) in enumerate(profile['publications']):
+                self.db.execute(
+                    'INSERT INTO publications VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (user, link) DO UPDATE SET position = excluded.position, title = excluded.title, '
+                    'authors = excluded.authors, citations = excluded.citations, year = excluded.year, '
+                    'source = excluded.source, last_seen = excluded.last_seen, '
+                    'author_position = excluded.author_position',
+                    (user, link, position, title, authors, citations, year, source, date, date,
+                     author_position(authors, key, key.split()[0], keys) if key else 0)
+                )
+                if known.get(link) != citations:
+                    self.db.execute('INSERT OR REPLACE INTO citation_history VALUES (?, ?, ?, ?)',
+                                    (user, link, date, citations))
+            self.db.executemany('INSERT OR REPLACE INTO citations_by_year VALUES (?, ?, ?)',
+                                [(user, y, c) for y, c in profile['citation_by_year']])
+            self.db.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)',
+                            (user, info[3], info[0], date, len(profile['publications'])))
+
+    def save_authorships(self, user, key, name, publications):
+        # The authors of the publications (pub key, [author names]) added to a CoauthorGraph for a scholar
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO scholar_authors VALUES (?, ?, ?)', (user, key, name))
+            self.db.executemany('INSERT OR IGNORE INTO authorships VALUES (?, ?, ?)', [
+                (pub, position, author) for pub, authors in publications for position, author in enumerate(authors)
+            ])
+
+    def authorships(self):
+        # All the (pub key, [author names]) and (user, key, name) of the scholars saved by save_authorships
+        with self.lock:
+            rows = self.db.execute('SELECT pub, name FROM authorships ORDER BY rowid').fetchall()
+            scholars = self.db.execute('SELECT user, key, name FROM scholar_authors').fetchall()
+        publications = defaultdict(list)
+        for pub, name in rows:
+            publications[pub].append(name)
+        return list(publications.items()), scholars
+
+    def resolution(self, query):
+        # The GS url a query was resolved to by AuthorResolver, if any
+        with self.lock:
+            row = self.db.execute('SELECT url FROM resolutions WHERE query = ?', (query,)).fetchone()
+        return row[0] if row else None
+
+    def save_resolution(self, query, url):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?)',
+                            (query, gs_user_id(url), url, datetime.now().strftime('%Y-%m-%d')))
+
+    def citation_history(self, user):
+        # (title, link, date, citations) for every recorded change of a scholar's citation counts
+        with self.lock:
+            return self.db.execute(
+                'SELECT p.title, h.link, h.date, h.citations FROM citation_history h '
+                'LEFT JOIN publications p ON p.user = h.user AND p.link = h.link '
+                'WHERE h.user = ? ORDER BY h.link, h.date', (user,)
+            ).fetchall()
+
+    def save_publication_details(self, user, details, date):
+        # Store the PublicationDetails crawled for a scholar's publications (replacing the ones crawled before)
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO publication_details VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+                (d.link, user, d.title, ', '.join(d.authors), d.date, d.source, d.abstract, d.citations, date)
+                for d in details])
+            self.db.executemany('DELETE FROM publication_citations WHERE link = ?', [(d.link,) for d in details])
+            self.db.executemany('INSERT INTO publication_citations VALUES (?, ?, ?)',
+                                [(d.link, y, c) for d in details for y, c in d.citation_by_year])
+
+    def publication_details(self, user):
+        # The PublicationDetails crawled for a scholar's publications, by link
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT link, title, authors, date, source, abstract, citations FROM publication_details '
+                'WHERE user = ?', (user,)).fetchall()
+            histograms = defaultdict(list)
+            for link, year, citations in self.db.execute(
+                    'SELECT c.link, c.year, c.citations FROM publication_citations c JOIN publication_details d '
+                    'ON d.link = c.link WHERE d.user = ? ORDER BY c.link, c.year', (user,)):
+                histograms[link].append((year, citations))
+        return {link: PublicationDetail(link, title, authors.split(', ') if authors else [], date, source, abstract,
+                                        citations, histograms[link])
+                for link, title, authors, date, source, abstract, citations in rows}
+
+    def cohort_rows(self, users=None):
+        # What a Cohort is made of, for the scholars with a snapshot (or only the given user ids):
+        # the (user, name, affiliation, specialization) rows, then the publications and the citations by year
+        # in columns: (users, number of rows per user, citations, years, author positions) and
+        # (users, number of rows per user, years, citations). The columns are read a user at a time with
+        # group_concat and parsed by NumPy, instead of a Python tuple per row. The citations and years are cast
+        # to integers by SQLite (the number they begin with, e.g., 57 for '57*', 0 if none)
+        rows = self.read_cohort(users)
+        if (rows[1][-1] < 0).any():
+            # the databases made before the author positions were stored are filled in once
+            self.fill_author_positions()
+            rows = self.read_cohort(users)
+        return rows
+
+    def read_cohort(self, users=None):
+        # See cohort_rows. The author positions not stored are -1
+        with self.lock, self.db:
+            # the scholars are filtered by SQLite, the publications of the others are not read
+            where = 'user IN (SELECT user FROM snapshots)'
+            if users is not None:
+                self.db.execute('CREATE TEMP TABLE IF NOT EXISTS cohort (user TEXT PRIMARY KEY)')
+                self.db.execute('DELETE FROM cohort')
+                self.db.executemany('INSERT OR IGNORE INTO cohort VALUES (?)', [(u,) for u in users])
+                where += ' AND user IN (SELECT user FROM cohort)'
+            scholars = self.db.execute(
+                'SELECT s.user, s.name, c.affiliation, c.specialization FROM snapshots s '
+                f'LEFT JOIN scholars c ON c.url = s.url WHERE {where.replace("user IN", "s.user IN")} ORDER BY s.rowid'
+            ).fetchall()
+
+            def columns(table, *values):
+                rows = self.db.execute(
+                    f'SELECT user, COUNT(*), {", ".join(f"group_concat({v})" for v in values)} FROM {table} '
+                    f'WHERE {where} GROUP BY user').fetchall()
+                return [[row[0] for row in rows], np.array([row[1] for row in rows], dtype=np.int64)] + [
+                    np.fromstring(','.join(row[i] for row in rows), dtype=np.int64, sep=',')
+                    for i in range(2, len(values) + 2)]
+
+            publications = columns('publications', 'CAST(citations AS INTEGER)', 'CAST(year AS INTEGER)',
+                                   'COALESCE(author_position, -1)')
+            citations_by_year = columns('citations_by_year', 'year', 'citations')
+        return scholars, publications, citations_by_year
+
+    def fill_author_positions(self):
+        # Store the author positions of the publications saved before they were (see save_snapshot)
+        with self.lock, self.db:
+            rows = self.db.execute(
+                'SELECT p.rowid, p.authors, s.name FROM publications p JOIN snapshots s ON s.user = p.user '
+                'WHERE p.author_position IS NULL').fetchall()
+            names, seen = {}, {}
+            for _, _, name in rows:
+                if name not in names:
+                    key = author_key(name or '')
+                    names[name] = key, key.split()[0] if key else ''
+            self.db.executemany('UPDATE publications SET author_position = ? WHERE rowid = ?', [
+                (author_position(authors or '', *names[name], seen) if names[name][0] else 0, rowid)
+                for rowid, authors, name in rows])
+
+    def close(self):
+        self.db.close()
+
+
+class CoauthorGraph:
+    """
+    The co-authorship graph of all the scholars scraped. Authors are identified by author_key, publications
+    by their normalized title, year and authors (so a paper on two scholars' homepages counts once, but two
+    papers called "Editorial" do not). The graph keeps an inverted
+    index from authors to publications and the adjacency in CSR arrays (indptr/indices/weights, the weight
+    being the number of joint publications). Profiles are added incrementally and, with a GSDatabase,
+    persisted, so the graph is loaded back instead of being recomputed. It can be shared by threads
+    (e.g., the profiles of AsyncGSAnalyzer are added from the executor's threads).
+
+        graph = CoauthorGraph(database)
+        graph.add_profile(profile)
+        graph.shared_collaborators('2M6S-aAAAAAJ', '66ioxOQAAAAJ')
+        graph.neighbourhood('RA Fisher', k=2)
+    """
+
+    def __init__(self, database=None):
+        self.database = database
+        # the profiles are added and the pending edges merged under the lock, which the queries take too
+        self.lock = RLock()
+        self.keys = []
+        self.names = []
+        self.index = {}
+        self.pubs = []
+        self.pub_index = {}
+        # author id -> publication ids
+        self.author_pubs = []
+        # user id -> author id of the scholar
+        self.scholars = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.empty(0, dtype=np.int64)
+        self.weights = np.empty(0, dtype=np.int64)
+        # edges not yet merged into the CSR arrays
+        self.pending = []
+        if database is not None:
+            publications, scholars = database.authorships()
+            # the scholars first, so that they are named as on their homepages
+            for user, key, name in scholars:
+                self.scholars[user] = self.author_id(key, name)
+            for pub, names in publications:
+                self.add_publication(pub, names)
+
+    def author_id(self, key, name):
+        i = self.index.get(key)
+        if i is None:
+            i = self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.names.append(name)
+            self.author_pubs.append([])
+        return i
+
+    @staticmethod
+    def publication_key(title, year, names):
+        # The normalized title, the year and the sorted author keys, separated by tabs (which titles have not)
+        keys = sorted({k for k in map(author_key, names) if k is not None})
+        return '\t'.join([' '.join(title.lower().split()), str(year).strip(), ', '.join(keys)])
+
+    def add_publication(self, pub, names):
+        # Add a publication (key, [author names]); return False if it is already in the graph
+        if pub in self.pub_index:
+            return False
+        p = self.pub_index[pub] = len(self.pubs)
+        self.pubs.append(pub)
+        ids = []
+        for name in names:
+            key = author_key(name)
+            if key is not None:
+                i = self.author_id(key, name)
+                if i not in ids:
+                    ids.append(i)
+        for i in ids:
+            self.author_pubs[i].append(p)
+        self.pending.extend((a, b) for a in ids for b in ids if a != b)
+        return True
+
+    def add_profile(self, profile):
+        # Add the publications of a profile extracted by GSAnalyzer.extract_profile
+        info = profile['info']
+        user, key = gs_user_id(info[3]), author_key(info[0])
+        with self.lock:
+            self.scholars[user] = i = self.author_id(key, info[0])
+            # named as on their homepage, as when the graph is loaded back from the database
+            self.names[i] = info[0]
+            new = []
+            for title, _, authors, _, year, _ in profile['publications']:
+                names = [a.strip() for a in authors.split(',') if author_key(a)]
+                pub = self.publication_key(title, year, names)
+                if self.add_publication(pub, names):
+                    new.append((pub, names))
+            if self.database is not None:
+                self.database.save_authorships(user, key, info[0], new)
+
+    def compact(self):
+        # Merge the pending edges into the CSR arrays
+        with self.lock:
+            if not self.pending:
+                return
+            n = len(self.keys)
+            pending = np.array(self.pending, dtype=np.int64)
+            rows = np.concatenate([np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr)), pending[:, 0]])
+            cols = np.concatenate([self.indices, pending[:, 1]])
+            weights = np.concatenate([self.weights, np.ones(len(pending), dtype=np.int64)])
+            pairs, inverse = np.unique(rows * n + cols, return_inverse=True)
+            self.weights = np.bincount(inverse.reshape(-1), weights=weights).astype(np.int64)
+            self.indices = pairs % n
+            self.indptr = np.concatenate([[0], np.cumsum(np.bincount(pairs // n, minlength=n))])
+            self.pending = []
+
+    def resolve(self, author):
+        # The author id of a scholar's user id, an author name or an author key
+        if author in self.scholars:
+            return self.scholars[author]
+        if author in self.index:
+            return self.index[author]
+        i = self.index.get(author_key(author))
+        if i is None:
+            raise KeyError(f'{author} is not in the co-authorship graph')
+        return i
+
+    def coauthors(self, author):
+        # (name, number of joint publications) of the co-authors, the most frequent first
+        with self.lock:
+            self.compact()
+            i = self.resolve(author)
+            cols = self.indices[self.indptr[i]:self.indptr[i + 1]]
+            weights = self.weights[self.indptr[i]:self.indptr[i + 1]]
+            order = np.argsort(-weights, kind='stable')
+            return [(self.names[cols[j]], int(weights[j])) for j in order]
+
+    def publications(self, author):
+        # The (normalized) titles of the publications of an author
+        with self.lock:
+            return [self.pubs[p].split('\t')[0] for p in self.author_pubs[self.resolve(author)]]
+
+    def shared_collaborators(self, a, b):
+        # (name, joint publications with a, joint publications with b) of the authors who worked with both
+        with self.lock:
+            self.compact()
+            i, j = self.resolve(a), self.resolve(b)
+            cols_i = self.indices[self.indptr[i]:self.indptr[i + 1]]
+            cols_j = self.indices[self.indptr[j]:self.indptr[j + 1]]
+            shared, pos_i, pos_j = np.intersect1d(cols_i, cols_j, assume_unique=True, return_indices=True)
+            w_i = self.weights[self.indptr[i]:self.indptr[i + 1]][pos_i]
+            w_j = self.weights[self.indptr[j]:self.indptr[j + 1]][pos_j]
+            order = np.argsort(-(w_i + w_j), kind='stable')
+            return [(self.names[shared[o]], int(w_i[o]), int(w_j[o])) for o in order]
+
+    def neighbourhood(self, author, k=1):
+        # {name: hops} of the authors within k hops of an author (the author excluded)
+        with self.lock:
+            self.compact()
+            start = self.resolve(author)
+            hops = np.full(len(self.keys), -1, dtype=np.int64)
+            hops[start] = 0
+            frontier = np.array([start])
+            for hop in range(1, k + 1):
+                if not len(frontier):
+                    break
+                starts, ends = self.indptr[frontier], self.indptr[frontier + 1]
+                lengths = ends - starts
+                # the positions of the neighbours of every frontier node in the indices array, at once
+                positions = np.repeat(starts - np.cumsum(np.concatenate([[0], lengths[:-1]])), lengths) + \
+                    np.arange(lengths.sum())
+                frontier = np.unique(self.indices[positions])
+                frontier = frontier[hops[frontier] < 0]
+                hops[frontier] = hop
+            found = np.flatnonzero(hops > 0)
+            return {self.names[i]: int(hops[i]) for i in found}
+
+
+def to_ints(values):
+    # Numbers scraped as text (e.g., '1234', '', '57*') as an int64 array, 0 if there is no number.
+    # Only the values that are not plain numbers go through the regex
+    values = pd.Series(values, dtype=object)
+    numbers = pd.to_numeric(values, errors='coerce')
+    other = numbers.isna()
+    if other.any():
+        numbers[other] = pd.to_numeric(values[other].astype(str).str.replace(r'\D', '', regex=True), errors='coerce')
+    return numbers.fillna(0).to_numpy(np.int64)
+
+
+def author_position(authors, key, last_name, keys):
+    # The (1-based) position of a scholar among the authors of a publication, 0 if not found.
+    # author_key is only called for the names that may match, i.e., with the last name in them,
+    # and only once per name thanks to `keys` (a dict shared by the calls)
+    for i, a in enumerate(authors.split(',')):
+        if last_name in a.lower() or not a.isascii():
+            k = keys.get(a)
+            if k is None:
+                k = keys[a] = author_key(a) or ''
+            if k == key:
+                return i + 1
+    return 0
+
+
+class Cohort:
+    """
+    Comparative metrics of many scholars at once, from the publications and citations stored in a GSDatabase
+    (by save_snapshot). The data is held in columns (numpy arrays, one entry per publication or per
+    scholar and year) so that every metric is computed for all the scholars together, without reopening
+    the workbooks. The metrics are returned as DataFrames indexed by GS user id.
+
+        cohort = Cohort.from_database(GSDatabase('GS Database.sqlite'), users=candidate_urls)
+        table = cohort.metrics()  # name, affiliation, ..., h_index, i10_index, citation_growth
+        cohort.group_by('specialization')
+    """
+
+    def __init__(self, scholars, publications, citations_by_year):
+        # the rows and columns of GSDatabase.cohort_rows
+        self.users = [row[0] for row in scholars]
+        self.names = np.array([row[1] or '' for row in scholars], dtype=object)
+        self.affiliations = np.array([row[2] or 'Unknown' for row in scholars], dtype=object)
+        self.specializations = np.array([row[3] or '' for row in scholars], dtype=object)
+        # the columns come a user at a time: each user is mapped to its scholar once, not each row
+        index = pd.Index(self.users)
+        users, counts, self.pub_citations, self.pub_year, self.pub_position = publications
+        self.pub_scholar = np.repeat(index.get_indexer(users), counts)
+        users, counts, self.cby_year, self.cby_citations = citations_by_year
+        self.cby_scholar = np.repeat(index.get_indexer(users), counts)
+
+    @classmethod
+    def from_database(cls, database, users=None):
+        # users: the GS homepage urls or user ids of the cohort, every scholar with a snapshot by default
+        if users is not None:
+            users = [gs_user_id(u) if 'user=' in u else u for u in users]
+        return cls(*database.cohort_rows(users))
+
+    def __len__(self):
+        return len(self.users)
+
+    def n_pubs(self):
+        return np.bincount(self.pub_scholar, minlength=len(self))
+
+    def citations(self):
+        # The citations of the publications stored, per scholar
+        return np.bincount(self.pub_scholar, weights=self.pub_citations, minlength=len(self)).astype(np.int64)
+
+    def h_index(self):
+        # The largest h such that h publications of a scholar have at least h citations each:
+        # the publications are sorted by scholar and citations (descending), then ranked within each scholar.
+        # Both are sorted at once as a single integer key, which is much faster than np.lexsort
+        if not len(self.pub_citations):
+            return np.zeros(len(self), dtype=np.int64)
+        m = max(int(self.pub_citations.max()), 0) + 1
+        keys = np.sort(self.pub_scholar * m + (m - 1 - np.maximum(self.pub_citations, 0)))
+        scholar, citations = keys // m, m - 1 - keys % m
+        n_pubs = self.n_pubs()
+        starts = np.cumsum(n_pubs) - n_pubs
+        rank = np.arange(len(keys)) - starts[scholar] + 1
+        return np.bincount(scholar, weights=citations >= rank, minlength=len(self)).astype(np.int64)
+
+    def i10_index(self):
+        # The number of publications with at least 10 citations
+        return np.bincount(self.pub_scholar, weights=self.pub_citations >= 10, minlength=len(self)).astype(np.int64)
+
+    def citation_matrix(self):
+        # (years, matrix) of the citations by year, one row per scholar and one column per year
+        if not len(self.cby_year):
+            return np.empty(0, dtype=np.int64), np.zeros((len(self), 0), dtype=np.int64)
+        first = self.cby_year.min()
+        years = np.arange(first, self.cby_year.max() + 1)
+        matrix = np.zeros((len(self), len(years)), dtype=np.int64)
+        matrix[self.cby_scholar, self.cby_year - first] = self.cby_citations
+        return years, matrix
+
+    def citations_by_year(self):
+        years, matrix = self.citation_matrix()
+        return pd.DataFrame(matrix, index=self.users, columns=years)
+
+    def citation_growth(self, year=None, span=1):
+        # The relative change of the citations per year between `year - span` and `year`, e.g., 0.25 for +25%.
+        # `year` defaults to the last full year stored (GS counts the current year so far). NaN without a base
+        years, matrix = self.citation_matrix()
+        if year is None:
+            full = years[years < datetime.now().year]
+            year = full.max() if len(full) else (years.max() if len(years) else 0)
+        growth = np.full(len(self), np.nan)
+        if year not in years or year - span not in years:
+            return growth
+        now, base = matrix[:, year - years[0]], matrix[:, year - span - years[0]]
+        np.divide(now - base, base, out=growth, where=base > 0)
+        return growth
+
+    def pubs_per_year(self):
+        # The number of publications per scholar and year (the publications without a year are left out)
+        dated = self.pub_year > 0
+        if not dated.any():
+            return pd.DataFrame(index=self.users)
+        scholar, year = self.pub_scholar[dated], self.pub_year[dated]
+        first, last = year.min(), year.max()
+        n_years = last - first + 1
+        counts = np.bincount(scholar * n_years + (year - first), minlength=len(self) * n_years)
+        return pd.DataFrame(counts.reshape(len(self), n_years), index=self.users, columns=np.arange(first, last + 1))
+
+    def author_positions(self, max_position=5):
+        # How often each scholar is the 1st, 2nd, ... author of the publications, as in authors_analysis.
+        # The positions after max_position are counted together; N/A is for the scholar not found among the authors
+        columns = [f'#_{i}' for i in range(1, max_position + 1)] + [f'#_{max_position + 1}+', '#_N/A']
+        bucket = np.where(self.pub_position == 0, max_position + 1, np.minimum(self.pub_position, max_position + 1) - 1)
+        counts = np.bincount(self.pub_scholar * len(columns) + bucket, minlength=len(self) * len(columns))
+        return pd.DataFrame(counts.reshape(len(self), len(columns)), index=self.users, columns=columns)
+
+    def metrics(self, year=None, span=1):
+        # One row per scholar: the basic info and the metrics
+        return pd.DataFrame({
+            'name': self.names,
+            'affiliation': self.affiliations,
+            'specialization': self.specializations,
+            'n_pubs': self.n_pubs(),
+            'citations': self.citations(),
+            'h_index': self.h_index(),
+            'i10_index': self.i10_index(),
+            'citation_growth': self.citation_growth(year, span),
+            'first_author': self.author_positions(1)['#_1'].to_numpy()
+        }, index=pd.Index(self.users, name='user'))
+
+    def group_by(self, by='affiliation', year=None, span=1):
+        # The number of scholars and the mean and median of the metrics per affiliation or specialization.
+        # A scholar is counted under each of their specializations
+        if by not in ('affiliation', 'specialization'):
+            raise ValueError(f"by must be 'affiliation' or 'specialization', not {by!r}")
+        table = self.metrics(year, span)
+        if by == 'specialization':
+            table[by] = table[by].str.split(';').map(lambda fields: [f.strip() for f in fields if f.strip()] or [''])
+            table = table.explode(by)
+        numeric = ['n_pubs', 'citations', 'h_index', 'i10_index', 'citation_growth', 'first_author']
+        groups = table.groupby(by)[numeric]
+        result = groups.agg(['mean', 'median'])
+        result.columns = [f'{metric}_{stat}' for metric, stat in result.columns]
+        result.insert(0, 'scholars', groups.size())
+        return result.sort_values('scholars', ascending=False)
+
+
+def gs_profile_database(res_dir, info, database=None):
+    # The basic info of the scholar searched will be aggregated into the GS database
+    # (GS_DATABASE in res_dir unless another GSDatabase is given). See GSDatabase.export_excel for an excel file
+    db = database or GSDatabase(res_dir + GS_DATABASE)
+    try:
+        if db.upsert_scholar(info):
+            print(f'{info[0]} added to {db.path}!')
+        else:
+            print(f'{info[0]} updated in {db.path}!')
+    finally:
+        if database is None:
+            db.close()
+
+
+def save_gs_profile(res_dir, profile, sheets, output='xlsx', add2database=True, database=None, graph=None,
+                    metrics=None, info_database=None):
+    # Save a profile and its sheets (see profile_sheets) and return the path of the researcher's GS profile.
+    # The basic info goes to info_database (database by default, see gs_profile_database) if add2database,
+    # the publications to the GSDatabase and the CoauthorGraph (if any), and the sheets to res_dir.
+    # The stages are timed in metrics, which is saved if it has a path
+    metrics = metrics if metrics is not None else Metrics()
+    with metrics.stage('database'):
+        if add2database:
+            gs_profile_database(res_dir, profile['info'], database=info_database or database)
+        if database is not None:
+            database.save_snapshot(profile)
+        if graph is not None:
+            graph.add_profile(profile)
+    with metrics.stage('write'):
+        path = write_gs_profile(res_dir, profile, sheets, output=output)
+    metrics.count('profiles')
+    if metrics.path:
+        metrics.dump()
+    return path
+
+
+def gs_page_url(url, cstart=0, pagesize=GS_PAGESIZE, sortby=None):
+    # The url of a given publication page of a GS homepage. GS lists the publications by citations,
+    # or by date (the most recent first) with sortby='pubdate'
+    parts = urlparse(url)
+    query = parse_qs(parts.query)
+    query['cstart'] = [str(cstart)]
+    query['pagesize'] = [str(pagesize)]
+    if sortby is not None:
+        query['sortby'] = [sortby]
+    return urlunparse(parts._replace(query=urlencode(query, doseq=True)))
+
+
+def xpath_to_css(xpath):
+    # Translate the simple xpaths used in this program, e.g. '//*[@id="gsc_a_b"]/tr/td[1]/a',
+    # into css selectors so that they can be run on a parsed page
+    m = re.fullmatch(r'//\*\[@id="([^"]+)"\]((?:/[a-z0-9]+(?:\[\d+\])?)*)', xpath)
+    if m is None:
+        raise ValueError(f'Unsupported xpath: {xpath}')
+    css = ['#' + m.group(1)]
+    for tag, n in re.findall(r'/([a-z0-9]+)(?:\[(\d+)\])?', m.group(2)):
+        css.append(f'{tag}:nth-of-type({n})' if n else tag)
+    return ' > '.join(css)
+
+
+def visible_text(tag):
+    # The text of a tag as shown in the browser. Spans of class "gs_oph" are hidden by GS on desktop
+    if tag is None:
+        return ''
+    texts = [s for s in tag.find_all(string=True)
+             if not any('gs_oph' in (p.get('class') or []) for p in s.parents)]
+    return ' '.join(''.join(texts).split())
+
+
+def parse_basic_info(soup):
+    # basic info parsed from a GS homepage: name, affiliation, homepage (if any),
+    # specialization, all-time citation, past 5 year citation
+    name = visible_text(soup.select_one('#gsc_prf_in'))
+    affiliation = soup.select_one('#gsc_prf_i > div:nth-of-type(2) > a')
+    affiliation = visible_text(affiliation) if affiliation else 'Unknown'
+    homepage = soup.select_one('#gsc_prf_ivh > a')
+    homepage = homepage['href'] if homepage and homepage.has_attr('href') else 'Not available'
+    specialization = '; '.join(visible_text(a) for a in soup.select('#gsc_prf_int > a'))
+    # the first row of the citation table that actually has cells (i.e., not the header)
+    rows = [tr for tr in soup.select('#gsc_rsb_st tr') if tr.find('td')]
+    cells = rows[0].find_all('td') if rows else []
+    all_citation = visible_text(cells[1]) if len(cells) > 1 else ''
+    past5y_citation = visible_text(cells[2]) if len(cells) > 2 else ''
+    return [name, affiliation, homepage, specialization, all_citation, past5y_citation]
+
+
+def parse_citation_by_year(soup):
+    years = [int(y.text) for y in soup.select('#gsc_rsb_cit > div > div.gsc_md_hist_w > div > span')]
+    citations = [int(c.text) for c in soup.select('#gsc_rsb_cit > div > div.gsc_md_hist_w > div > a > span')]
+    return list(zip(years, citations))
+
+
+def parse_publication_rows(soup, base_url=GS_HOST, drop=False):
+    # Publication rows parsed from a GS homepage: (title, link, author(s), citation, year, source).
+    # With drop, the rows (most of the page) are removed from the soup once parsed
+    rows = []
+    trs = soup.select('#gsc_a_b > tr')
+    for tr in trs:
+        tds = tr.find_all('td', recursive=False)
+        title = tds[0].find('a') if tds else None
+        # the placeholder row shown when there is no (more) publication has no title link
+        if title is None:
+            continue
+        divs = tds[0].find_all('div', recursive=False)
+        rows.append((
+            visible_text(title),
+            urljoin(base_url, title.get('data-href') or title.get('href') or ''),
+            visible_text(divs[0]) if divs else '',
+            visible_text(tds[1]) if len(tds) > 1 else '',
+            visible_text(tds[2]) if len(tds) > 2 else '',
+            visible_text(divs[1]) if len(divs) > 1 else ''
+        ))
+    if drop:
+        for tr in trs:
+            tr.decompose()
+    return rows
+
+
+# The detail page of a publication: the full author list (GS shortens it with "..." on the homepage),
+# the publication date, the journal/conference/book, the abstract, the total citations and the citations per year
+PublicationDetail = namedtuple('PublicationDetail', ['link', 'title', 'authors', 'date', 'source', 'abstract',
+                                                     'citations', 'citation_by_year'])
+
+
+def parse_publication_detail(soup, link):
+    # A PublicationDetail parsed from the detail page of a publication (the link of parse_publication_rows)
+    fields = {visible_text(row.select_one('.gsc_oci_field')): row.select_one('.gsc_oci_value')
+              for row in soup.select('#gsc_oci_table > .gs_scl') if row.select_one('.gsc_oci_field')}
+    authors = visible_text(fields.get('Authors') or fields.get('Inventors'))
+    source = next((visible_text(fields[f]) for f in ('Journal', 'Conference', 'Book', 'Source', 'Publisher')
+                   if f in fields), '')
+    cited_by = fields.get('Total citations')
+    cited_by = re.findall(r'Cited by (\d+)', visible_text(cited_by.find('a') if cited_by else None))
+    # the bars link to the citations of their year; the years without citations have no bar
+    years = [int(t.text) for t in soup.select('.gsc_oci_g_t')]
+    citation_by_year = []
+    for j, bar in enumerate(soup.select('a.gsc_oci_g_a')):
+        year = parse_qs(urlparse(bar.get('href', '')).query).get('as_ylo')
+        year = int(year[0]) if year else (years[j] if j < len(years) else None)
+        if year is not None:
+            citation_by_year.append((year, int(visible_text(bar) or 0)))
+    return PublicationDetail(
+        link,
+        visible_text(soup.select_one('#gsc_oci_title')),
+        [a.strip() for a in authors.split(',') if a.strip()],
+        visible_text(fields.get('Publication date')),
+        source,
+        visible_text(soup.select_one('#gsc_oci_descr')),
+        int(cited_by[0]) if cited_by else 0,
+        citation_by_year
+    )
+
+
+class PublicationCrawler:
+    """
+    Fetch the detail page of every publication of a profile for the full author list, the abstract and the
+    citations per year. The pages are fetched by `workers` threads, which never wait for each other, and saved
+    in the GSDatabase (if any) every `batch_size` pages fetched, so that a crawl cut short is not lost.
+    With a database, the papers whose citation count on the homepage has not changed since they were last
+    crawled are not fetched again. As GS blocks the clients that crawl too fast, the requests are throttled
+    by `limiter`, or by a RateLimiter(rate, burst) of the crawler's own (rate=None for no limit, e.g., on a
+    local server), and retried on a 429. A ResponseCache helps too, the detail pages being kept for a week by default.
+
+        crawler = PublicationCrawler(database=database, workers=8)
+        details = crawler.crawl(profile)
+    """
+
+    def __init__(self, session=None, database=None, limiter=None, retries=3, cache=None, workers=8, batch_size=50,
+                 metrics=None, rate=2.0, burst=4):
+        self.own_session = session is None
+        self.session = session or gs_session(workers)
+        self.database = database
+        self.limiter = limiter or (RateLimiter(rate, burst) if rate else None)
+        self.retries = retries
+        self.cache = cache
+        self.workers = workers
+        self.batch_size = batch_size
+        self.metrics = metrics if metrics is not None else Metrics()
+        # the papers that could not be fetched in the last crawl, by link
+        self.errors = {}
+
+    def fetch_detail(self, link):
+        try:
+            r = fetch(self.session, link, limiter=self.limiter, retries=self.retries, cache=self.cache,
+                      metrics=self.metrics)
+            r.raise_for_status()
+            return parse_publication_detail(bs(r.content, 'html.parser'), link)
+        except Exception as e:
+            return e
+
+    def crawl(self, profile, force=False):
+        # A PublicationDetail per publication of a profile (see GSAnalyzer.extract_profile), in the same order:
+        # crawled now or, if unchanged (unless force), taken from the database. None if it could not be fetched
+        user, date = gs_user_id(profile['info'][3]), profile['info'][-1]
+        publications = profile['publications']
+        table = publications if isinstance(publications, PublicationTable) else PublicationTable(publications)
+        links = [table.link(i) for i in range(len(table))]
+        details = {}
+        if self.database is not None and not force:
+            details = self.database.publication_details(user)
+        todo = [link for link, citations in zip(links, table.citations)
+                if link not in details or details[link].citations != max(citations, 0)]
+        self.metrics.count('details_skipped', len(links) - len(todo))
+        self.errors = {}
+        crawled = []
+
+        def save():
+            if self.database is not None and crawled:
+                self.database.save_publication_details(user, crawled, date)
+            self.metrics.count('details', len(crawled))
+            crawled.clear()
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            # every page is submitted at once, and the pages are saved as they come
+            futures = {pool.submit(self.fetch_detail, link): link for link in todo}
+            for future in as_completed(futures):
+                link, detail = futures[future], future.result()
+                if isinstance(detail, Exception):
+                    self.errors[link] = detail
+                    continue
+                details[link] = detail
+                crawled.append(detail)
+                if len(crawled) >= self.batch_size:
+                    save()
+            save()
+        if self.errors:
+            print(f'{len(self.errors)} of the {len(todo)} publication pages could not be fetched')
+        return [details.get(link) for link in links]
+
+    def close(self):
+        if self.own_session:
+            self.session.close()
 
 
 class GSAnalyzer:
 
-    def __init__(self, wd, res_dir):
-        self.wd = wd
+    def __init__(self, wd, res_dir, backend='selenium', session=None, extraction='bulk', limiter=None, retries=0,
+                 cache=None, database=None, graph=None, metrics=None):
+        """
+        :param wd: a selenium webdriver. Not needed (can be None) if backend='http'
+        :param res_dir: the output directory
+        :param backend: 'selenium' drives the browser; 'http' fetches and parses the GS pages directly,
+        which is much faster but relies on the html GS serves without javascript
+        :param session: a requests.Session for the http backend (created if not given). A session given is
+        left open by close, so that it can be shared
+        :param extraction: for the selenium backend. 'bulk' takes the rendered page once and parses it locally;
+        'xpath' queries the browser element by element, which costs one WebDriver call per cell
+        :param limiter: a RateLimiter (possibly shared with other GSAnalyzers) that every page load waits for
+        :param retries: how many times an http request is retried on a 429/5xx response or a connection error
+        :param cache: a ResponseCache for the pages fetched over http
+        :param database: a GSDatabase where the scraped publications are kept for incremental refreshes,
+        and where the basic info goes (if add2database). Otherwise, GS_DATABASE in res_dir is used for the latter
+        :param graph: a CoauthorGraph that every profile generated is added to
+        :param metrics: the Metrics (possibly shared with other GSAnalyzers) where the time of each stage and
+        the requests, bytes, WebDriver calls and rows are recorded. A new one is kept in self.metrics by default
+        """
+        if backend not in ('selenium', 'http'):
+            raise ValueError(f"backend must be 'selenium' or 'http', not {backend!r}")
+        if extraction not in ('bulk', 'xpath'):
+            raise ValueError(f"extraction must be 'bulk' or 'xpath', not {extraction!r}")
+        self.metrics = metrics if metrics is not None else Metrics()
+        # every WebDriver call is counted
+        self.wd = WebDriverCounter(wd, self.metrics) if wd is not None else None
         self.res_dir = res_dir if res_dir.endswith('/') else res_dir + '/'
+        self.backend = backend
+        # the http backend always parses the pages locally
+        self.bulk = backend == 'http' or extraction == 'bulk'
+        self.soup = None
+        self.pub_rows = None
+        # the PublicationTable of the profile loaded
+        self.publications = None
+        # a session given is shared: it is left open by close
+        self.own_session = backend == 'http' and session is None
+        if self.own_session:
+            session = gs_session()
+        self.session = session
+        self.limiter = limiter
+        self.retries = retries
+        self.cache = cache
+        self.database = database
+        self.graph = graph
+        self.snapshot = None
+        # the publications added since the snapshot, when refreshing
+        self.recent = []
 
-    def loading_gs_homepage(self, url, loading_sp=1, pages_to_load=5):
-        # loading a researcher's GS homepage to the fullest or to a given page
-        self.wd.get(url)
+    def loading_gs_homepage(self, url, loading_sp=10, pages_to_load=5, refresh=False, stop_after=20,
+                            target=None, deadline=None, poll=0.1):
+        """
+        Load a researcher's GS homepage to the fullest or to a given page. The first GS_PAGESIZE publications
+        are asked for directly, then "show more" is clicked for each further page, and the loading goes on as
+        soon as the new publications are shown (or the button is disabled, i.e., there is no more).
+        :param loading_sp: the longest wait (in seconds) for a page of publications to be shown
+        :param pages_to_load: the number of "show more" clicks (http: further pages), None for no limit
+        :param refresh: with a database, stop as soon as the last `stop_after` publications loaded are
+        unchanged since the snapshot; the rest is then taken from the snapshot, except for the publications
+        added since (see recent_publications)
+        :param target: stop once that many publications are loaded
+        :param deadline: the longest time (in seconds) for the whole loading
+        :param poll: how often (in seconds) the page is checked while waiting
+        :return: the timings of the pages loaded, [(page, publications loaded, seconds)], also kept in
+        self.load_timings
+        """
+        self.snapshot = None
+        self.recent = []
+        if refresh:
+            if self.database is None:
+                raise ValueError('A GSDatabase is needed to refresh a profile')
+            self.snapshot = self.database.snapshot(gs_user_id(url)) or None
+        # nothing of the previous profile is kept
+        self.publications = None
+        with self.metrics.stage('load'):
+            if self.backend == 'http':
+                timings = self.loading_gs_homepage_by_http(url, pages_to_load=pages_to_load, stop_after=stop_after,
+                                                           target=target, deadline=deadline)
+            else:
+                timings = self.loading_gs_homepage_by_selenium(url, loading_sp=loading_sp, pages_to_load=pages_to_load,
+                                                               stop_after=stop_after, target=target,
+                                                               deadline=deadline, poll=poll)
+        self.metrics.count('pages', len(timings))
+        return timings
+
+    def loading_gs_homepage_by_selenium(self, url, loading_sp=10, pages_to_load=5, stop_after=20, target=None,
+                                        deadline=None, poll=0.1):
+        # See loading_gs_homepage
+        from selenium.webdriver.common.by import By
+        if self.limiter is not None:
+            self.limiter.acquire()
+        start = time.monotonic()
+        self.wd.get(gs_page_url(url, 0))
         self.url = url
-        # the publication list in the previous page before loading
-        pre_page_plist = self.wd.find_elements_by_class_name('gsc_a_tr')
-        # keep loading the webpage
-        show_more = self.wd.find_element_by_xpath('//*[@id="gsc_bpf_more"]/span/span[2]')
-        loading_sp = loading_sp
-        pages_to_load = pages_to_load
+        # the page is parsed again (once) after it has been loaded
+        self.soup = None
+        self.pub_rows = None
+        n_rows = len(self.wd.find_elements(By.CLASS_NAME, 'gsc_a_tr'))
+        self.load_timings = [(0, n_rows, time.monotonic() - start)]
+        show_more = self.wd.find_element(By.XPATH, '//*[@id="gsc_bpf_more"]/span/span[2]')
         click_times = 0
-        while click_times < pages_to_load:
+        while pages_to_load is None or click_times < pages_to_load:
+            if target is not None and n_rows >= target:
+                break
+            if self.snapshot and self.snapshot_reached(
+                    parse_publication_rows(bs(self.wd.page_source, 'html.parser'), url), stop_after):
+                self.recent = self.recent_publications(url)
+                break
+            if self.no_more_publications():
+                break
+            timeout = loading_sp
+            if deadline is not None:
+                timeout = min(timeout, deadline - (time.monotonic() - start))
+                if timeout <= 0:
+                    break
+            page_start = time.monotonic()
             show_more.click()
             click_times += 1
-            time.sleep(loading_sp)
-            cur_page_plist = self.wd.find_elements_by_class_name('gsc_a_tr')
-            if len(pre_page_plist) == len(cur_page_plist):
-                self.plist = cur_page_plist
+            shown = self.wait_until(
+                lambda: len(self.wd.find_elements(By.CLASS_NAME, 'gsc_a_tr')) > n_rows or self.no_more_publications(),
+                timeout, poll
+            )
+            cur_rows = len(self.wd.find_elements(By.CLASS_NAME, 'gsc_a_tr'))
+            self.load_timings.append((click_times, cur_rows - n_rows, time.monotonic() - page_start))
+            # nothing more was shown in time
+            if not shown or cur_rows == n_rows:
                 break
-            else:
-                pre_page_plist = cur_page_plist
+            n_rows = cur_rows
+        return self.load_timings
+
+    def no_more_publications(self):
+        # GS disables the "show more" button once every publication is shown
+        from selenium.webdriver.common.by import By
+        return self.wd.find_element(By.XPATH, '//*[@id="gsc_bpf_more"]').get_attribute('disabled') is not None
+
+    @staticmethod
+    def wait_until(condition, timeout, poll=0.1):
+        # Check a condition every `poll` seconds until it holds (True) or `timeout` seconds have passed (False)
+        end = time.monotonic() + timeout
+        while True:
+            if condition():
+                return True
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(poll, remaining))
+
+    def http_get(self, url):
+        return fetch(self.session or requests, url, limiter=self.limiter, retries=self.retries, cache=self.cache,
+                     metrics=self.metrics)
+
+    def snapshot_reached(self, rows, stop_after=20):
+        # Whether the last `stop_after` rows loaded are unchanged since the snapshot
+        unchanged = {(title, link, citations) for title, link, _, citations, _, _ in self.snapshot}
+        tail = rows[-stop_after:]
+        return len(tail) == stop_after and all((r[0], r[1], r[3]) in unchanged for r in tail)
+
+    def recent_publications(self, url):
+        # The publications not in the snapshot, loaded by date until a page has some that are. GS lists the
+        # publications by citations, so the new ones (hardly cited yet) come last and a refresh that stops
+        # at the first unchanged publications would miss them. The pages are fetched over http (see http_get)
+        known = {row[1] for row in self.snapshot}
+        recent = []
+        cstart = 0
+        while True:
+            r = self.http_get(gs_page_url(url, cstart, sortby='pubdate'))
+            r.raise_for_status()
+            rows = parse_publication_rows(bs(r.content, 'html.parser'), url)
+            self.metrics.count('pages')
+            new = [row for row in rows if row[1] not in known]
+            recent.extend(new)
+            cstart += len(rows)
+            if len(new) < len(rows) or len(rows) < GS_PAGESIZE:
+                return recent
+
+    def loading_gs_homepage_by_http(self, url, pages_to_load=5, stop_after=20, target=None, deadline=None):
+        # Same as loading_gs_homepage without a browser: the publications are paged with
+        # the cstart/pagesize parameters. Each page holds up to GS_PAGESIZE publications.
+        self.url = url
+        start = time.monotonic()
+        r = self.http_get(gs_page_url(url, 0))
+        r.raise_for_status()
+        # the soup is kept for the basic info and the citations by year, not for the publications
+        self.soup = bs(r.content, 'html.parser')
+        self.pub_rows = parse_publication_rows(self.soup, url, drop=True)
+        self.load_timings = [(0, len(self.pub_rows), time.monotonic() - start)]
+        pages_loaded = 0
+        # a page that is not full is the last one
+        while (pages_to_load is None or pages_loaded < pages_to_load) and self.pub_rows and \
+                len(self.pub_rows) % GS_PAGESIZE == 0:
+            if self.snapshot and self.snapshot_reached(self.pub_rows, stop_after):
+                self.recent = self.recent_publications(url)
+                break
+            if target is not None and len(self.pub_rows) >= target:
+                break
+            if deadline is not None and time.monotonic() - start >= deadline:
+                break
+            page_start = time.monotonic()
+            r = self.http_get(gs_page_url(url, len(self.pub_rows)))
+            r.raise_for_status()
+            rows = parse_publication_rows(bs(r.content, 'html.parser'), url)
+            if not rows:
+                break
+            self.pub_rows.extend(rows)
+            pages_loaded += 1
+            self.load_timings.append((pages_loaded, len(rows), time.monotonic() - page_start))
+        return self.load_timings
+
+    def page_soup(self):
+        # The loaded GS homepage, parsed once: a single WebDriver call instead of one per element
+        if self.soup is None:
+            self.soup = bs(self.wd.page_source, 'html.parser')
+        return self.soup
+
+    def publication_rows(self):
+        if self.pub_rows is None:
+            self.pub_rows = parse_publication_rows(self.page_soup(), self.url, drop=True)
+        return self.pub_rows
 
     def list_of_texts_by_xpath(self, xpath):
-        targets = self.wd.find_elements_by_xpath(xpath)
+        if self.bulk:
+            return [visible_text(target) for target in self.page_soup().select(xpath_to_css(xpath))]
+        from selenium.webdriver.common.by import By
+        targets = self.wd.find_elements(By.XPATH, xpath)
         return [target.text for target in targets]
 
     def gs_basic_info(self):
         # basic info: name, affiliation, homepage (if any), gs_url, specialization,
         # all-time citation, past 5 year citation, date recorded
+        if self.bulk:
+            name, affiliation, homepage, specialization, all_citation, past5y_citation = \
+                parse_basic_info(self.page_soup())
+            self.gs_name = name
+            self.date = datetime.now().strftime('%Y-%m-%d')
+            return [name, affiliation, homepage, self.url, specialization, all_citation, past5y_citation, self.date]
 
-        self.gs_name = self.wd.find_element_by_xpath('//*[@id="gsc_prf_in"]').text
+        from selenium.webdriver.common.by import By
+        self.gs_name = self.wd.find_element(By.XPATH, '//*[@id="gsc_prf_in"]').text
         try:
-            affiliation = self.wd.find_element_by_xpath('//*[@id="gsc_prf_i"]/div[2]/a').text
+            affiliation = self.wd.find_element(By.XPATH, '//*[@id="gsc_prf_i"]/div[2]/a').text
         except:
             affiliation = 'Unknown'
         try:
-            homepage = self.wd.find_element_by_xpath('//*[@id="gsc_prf_ivh"]/a').get_attribute('href')
+            homepage = self.wd.find_element(By.XPATH, '//*[@id="gsc_prf_ivh"]/a').get_attribute('href')
         except:
             homepage = 'Not available'
         specialization = '; '.join(self.list_of_texts_by_xpath('//*[@id="gsc_prf_int"]/a'))
-        all_citation = self.wd.find_element_by_xpath('//*[@id="gsc_rsb_st"]/tbody/tr[1]/td[2]').text
-        past5y_citation = self.wd.find_element_by_xpath('//*[@id="gsc_rsb_st"]/tbody/tr[1]/td[3]').text
+        all_citation = self.wd.find_element(By.XPATH, '//*[@id="gsc_rsb_st"]/tbody/tr[1]/td[2]').text
+        past5y_citation = self.wd.find_element(By.XPATH, '//*[@id="gsc_rsb_st"]/tbody/tr[1]/td[3]').text
 
         self.date = datetime.now().strftime('%Y-%m-%d')
         return [self.gs_name, affiliation, homepage, self.url, specialization, all_citation, past5y_citation, self.date]
 
     def citation_by_year(self):
         # Return the citation number over the years
-        r = requests.get(self.url)
-        soup = bs(r.content, 'html.parser')
-        years = [int(y.text) for y in soup.select('#gsc_rsb_cit > div > div.gsc_md_hist_w > div > span')]
-        citations = [int(c.text) for c in soup.select('#gsc_rsb_cit > div > div.gsc_md_hist_w > div > a > span')]
-        return zip(years, citations)
+        if self.bulk:
+            # the homepage has already been loaded
+            return parse_citation_by_year(self.page_soup())
+        r = self.http_get(self.url)
+        return parse_citation_by_year(bs(r.content, 'html.parser'))
 
     def gs_publication_info(self):
         # Publication info: title, author, link (for more details),
         # author(s), citation, year, source (place of publication)
-        titles_links = self.wd.find_elements_by_xpath('//*[@id="gsc_a_b"]/tr/td[1]/a')
-        self.titles = [title.text for title in titles_links]
-        self.links = ['https://scholar.google.com' + link.get_attribute('data-href') for link in titles_links]
-        self.authors = self.list_of_texts_by_xpath('//*[@id="gsc_a_b"]/tr/td[1]/div[1]')
-        self.citations = self.list_of_texts_by_xpath('//*[@id="gsc_a_b"]/tr/td[2]')
-        self.years = self.list_of_texts_by_xpath('//*[@id="gsc_a_b"]/tr/td[3]')
-        self.source = self.list_of_texts_by_xpath('//*[@id="gsc_a_b"]/tr/td[1]/div[2]')
-        return zip(self.titles, self.links, self.authors, self.citations, self.years, self.source)
+        if self.publications is not None:
+            return self.publications
+        if self.bulk:
+            rows = self.publication_rows()
+        else:
+            from selenium.webdriver.common.by import By
+            titles_links = self.wd.find_elements(By.XPATH, '//*[@id="gsc_a_b"]/tr/td[1]/a')
+            rows = list(zip(
+                [title.text for title in titles_links],
+                [urljoin(self.url, link.get_attribute('data-href')) for link in titles_links],
+                self.list_of_texts_by_xpath('//*[@id="gsc_a_b"]/tr/td[1]/div[1]'),
+                self.list_of_texts_by_xpath('//*[@id="gsc_a_b"]/tr/td[2]'),
+                self.list_of_texts_by_xpath('//*[@id="gsc_a_b"]/tr/td[3]'),
+                self.list_of_texts_by_xpath('//*[@id="gsc_a_b"]/tr/td[1]/div[2]')
+            ))
+        if self.snapshot:
+            # the publications not loaded again are taken from the snapshot
+            rows = merge_publications(rows, self.snapshot, self.recent)
+        self.publications = PublicationTable(rows)
+        # only the table is kept
+        self.pub_rows = None
+        return self.publications
+
+    def publication_table(self):
+        # The PublicationTable of the profile loaded, extracted once
+        if self.publications is None:
+            self.gs_publication_info()
+        return self.publications
 
     def titles_ngram_analysis(self, n_gram=2, most_used=20):
         # Return unigram and specified ngram analysis of the titles
-        if not self.titles:
-            self.titles = self.list_of_texts_by_xpath('//*[@id="gsc_a_b"]/tr/td[1]/a')
-        unigram = filtered_ngram(self.titles, 1)
-        ngram_ = filtered_ngram(self.titles, n_gram)
-        fdist_ug = counter(unigram)
-        fdist_ug = fdist_ug[:most_used] if len(fdist_ug) >= most_used else fdist_ug
-        fdist_ng = counter(ngram_)
-        fdist_ng = fdist_ng[:most_used] if len(fdist_ng) >= most_used else fdist_ng
-        if len(fdist_ng) < len(fdist_ug):
-            for i in range(len(fdist_ug) - len(fdist_ng)):
-                fdist_ng.append(('', ''))
-        splitter = [''] * len(fdist_ug)
-
-        return zip(fdist_ug, splitter, fdist_ng)
+        return self.publication_table().titles_ngram_analysis(n_gram, most_used)
 
     def num_of_pub_by_year(self):
         # Return the number of publication each year
-        if not self.years:
-            self.years = self.list_of_texts_by_xpath('//*[@id="gsc_a_b"]/tr/td[3]')
-        years = [str(y) for y in self.years]
-        return counter(years)
+        return self.publication_table().num_of_pub_by_year()
 
     def authors_analysis(self):
-        # 1. The contribution of the researcher of interest to the publications that he/she authored.
-        # The contribution is intuitively displayed as the frequency of the author ranks the researcher was in.
-        # 2. The list of co-author, including the researcher him/herself.
-        if not self.authors:
-            self.authors = self.list_of_texts_by_xpath('//*[@id="gsc_a_b"]/tr/td[1]/div[1]')
-
-        auth_list = []
-        last_name = self.gs_name.split()[-1].strip()
-        contribution_index = []
-
-        for au in self.authors:
-            l = [a.strip() for a in au.split(',')]
-            auth_list.extend(l)
-            if last_name in au:
-                contribution_index.extend([l.index(i) + 1 for i in l if last_name in i])
-            else:
-                contribution_index.append('N/A')
+        return self.publication_table().authors_analysis(self.gs_name)
 
-        ctr_fdist = counter(contribution_index)
-        ctr_fdist = [('Which author', 'Count')] + [('#_' + str(i), j) for i, j in ctr_fdist]
-        ctr_fdist += [('# of Pubs', len(self.authors)), ('', ''), ('Author', 'Count')]
-        auth_fdist = counter(auth_list)
+    def gs_profile_database(self, info):
+        gs_profile_database(self.res_dir, info, database=self.database)
 
-        return ctr_fdist + auth_fdist
+    def extract_profile(self):
+        # Everything scraped from the loaded homepage, detached from the driver/session,
+        # so that it can be analyzed and saved elsewhere (e.g., in another thread)
+        with self.metrics.stage('basic_info'):
+            info = self.gs_basic_info()
+        with self.metrics.stage('citation_by_year'):
+            citation_by_year = list(self.citation_by_year())
+        with self.metrics.stage('publications'):
+            publications = self.gs_publication_info()
+        self.metrics.count('rows', len(publications))
+        return {'info': info, 'citation_by_year': citation_by_year, 'publications': publications}
 
-    def gs_profile_database(self, info):
-        # The basic info of the scholar searched will be aggregated into an excel file
-        path = self.res_dir + 'Aggregated GS Database.xlsx'
-        if os.path.exists(path):
-            df = pd.read_excel(path)
-            df.loc[df.shape[0]] = info
-            print(f'File {path} created!')
-        else:
-            df = pd.DataFrame(columns=[
-                'Name', 'Affiliation', 'Homepage', 'GScholarUrl', 'Specialization',
-                'Citation(All)', 'Citation(Past 5 Year)', 'Date Recorded'
-            ])
-            df.loc[0] = info
-            print(f'File {path} updated!')
-        df.to_excel(path, index=False)
+    def crawl_details(self, profile, workers=8, batch_size=50, force=False, rate=2.0, burst=4):
+        # The PublicationDetails of a profile's publications (see PublicationCrawler), fetched over http with
+        # the session, rate limiter, cache and database of this GSAnalyzer. Without a rate limiter, the crawl is
+        # throttled by a RateLimiter(rate, burst) of its own; the requests are retried at least 3 times
+        crawler = PublicationCrawler(session=self.session, database=self.database, limiter=self.limiter,
+                                     retries=max(self.retries, 3), cache=self.cache, workers=workers,
+                                     batch_size=batch_size, metrics=self.metrics, rate=rate, burst=burst)
+        try:
+            with self.metrics.stage('details'):
+                return crawler.crawl(profile, force=force)
+        finally:
+            crawler.close()
 
-    def gs_profile_generator(self, n_gram=2, most_used=20, add2database=True):
+    def gs_profile_generator(self, n_gram=2, most_used=20, add2database=True, output='xlsx', details=False):
         """
         :param n_gram: for the analysis of the publication titles
         :param most_used: for the analysis of the publication titles
         :param add2database: whether the researcher's basic info is saved in the aggregated database
-        :return: The researcher's GS profile and by default the Aggregated GS Database (basic info)
+        :param output: 'xlsx', 'csv', 'jsonl' or 'parquet' (see write_gs_profile)
+        :param details: whether the detail page of every publication is crawled too (see crawl_details),
+        for a Publication Details sheet with the full author lists, the abstracts and the citations per year
+        :return: The path of the researcher's GS profile. By default the GS database (basic info) is updated too
         """
-        info = self.gs_basic_info()
-        basic_info = pd.Series(info, index=[
-            'Name', 'Affiliation', 'Homepage', 'GScholarUrl', 'Specialization',
-            'Citation(All)', 'Citation(Past 5 Year)', 'Date Recorded'
-        ])
-        citation_by_y = pd.DataFrame(self.citation_by_year(), columns=['Year', 'Citation'])
-        publication_info = pd.DataFrame(self.gs_publication_info(), columns=[
-            'Title', 'Link', 'Author', 'Citation', 'Year', 'Source'
-        ])
-        titles_ngram = pd.DataFrame(self.titles_ngram_analysis(n_gram, most_used), columns=[
-            'Unigram', '', f'{n_gram}-gram'
-        ])
-        pub_years = pd.DataFrame(self.num_of_pub_by_year(), columns=['Year', 'Count'])
-        authors = pd.DataFrame(self.authors_analysis())
+        profile = self.extract_profile()
+        if details:
+            profile['details'] = self.crawl_details(profile)
+        with self.metrics.stage('analyze'):
+            sheets = profile_sheets(profile, n_gram=n_gram, most_used=most_used)
+        return self.write_profile(profile, sheets, add2database=add2database, output=output)
 
-        if add2database:
-            self.gs_profile_database(info)
-
-        writer = pd.ExcelWriter(f'{self.res_dir}{self.gs_name} GSProfile_{self.date}.xlsx')
-        basic_info.to_excel(writer, sheet_name='Basic Info', header=False)
-        citation_by_y.to_excel(writer, sheet_name='Citation by Year', index=False)
-        publication_info.to_excel(writer, sheet_name='Publication Info', index=False)
-        titles_ngram.to_excel(writer, sheet_name='Titles Ngram', index=False)
-        pub_years.to_excel(writer, sheet_name='Pub Num by Year', index=False)
-        authors.to_excel(writer, sheet_name='Authors Analysis', header=False, index=False)
-        writer.save()
-        print(f'File {self.res_dir}{self.gs_name} GSProfile_{self.date}.xlsx saved!')
-
-    def gs_profiles_generators_by_urls(self, urls, loading_sp=1, pages_to_load=5, n_gram=2, most_used=20, add2database=True):
+    def write_profile(self, profile, sheets, add2database=True, output='xlsx'):
+        # Save a profile and its sheets (see save_gs_profile) and return the path of the researcher's GS profile
+        return save_gs_profile(self.res_dir, profile, sheets, output=output, add2database=add2database,
+                               database=self.database, graph=self.graph, metrics=self.metrics)
+
+    def gs_profiles_generators_by_urls(self, urls, loading_sp=10, pages_to_load=5, n_gram=2, most_used=20, add2database=True,
+                                       jobs=None):
+        # Return a BatchResult per url: failures are reported as values instead of stopping the batch.
+        # With jobs (a JobQueue or the path of one), the progress of every url is saved as it goes, so that
+        # the batch can be resumed after a crash (see resume) or shared with other processes
         if not type(urls) is list:
             print('Please enter a list of urls!')
+            urls = [urls]
+        if jobs is not None:
+            queue = jobs if isinstance(jobs, JobQueue) else JobQueue(jobs)
+            queue.add(urls)
+            for job in iter(queue.claim, None):
+                self.run_job(queue, job, loading_sp=loading_sp, pages_to_load=pages_to_load, n_gram=n_gram,
+                             most_used=most_used, add2database=add2database)
+            results = queue.results(urls)
+            if queue is not jobs:
+                queue.close()
+            self.close()
+            return results
+
+        results = []
+        for url in urls:
             try:
-                self.loading_gs_homepage(urls, loading_sp=loading_sp, pages_to_load=pages_to_load)
-                self.gs_profile_generator(n_gram=n_gram, most_used=most_used, add2database=add2database)
-            except:
-                self.close()
-        else:
-            for url in urls:
-                try:
-                    self.loading_gs_homepage(url)
-                    self.gs_profile_generator(n_gram=n_gram, most_used=most_used, add2database=add2database)
-                except:
-                    print(f'Nothing found in {url}')
+                self.loading_gs_homepage(url, loading_sp=loading_sp, pages_to_load=pages_to_load)
+                path = self.gs_profile_generator(n_gram=n_gram, most_used=most_used, add2database=add2database)
+                results.append(BatchResult(url, url, path, None))
+            except Exception as e:
+                print(f'Nothing found in {url}: {e!r}')
+                results.append(BatchResult(url, url, None, e))
         self.close()
+        return results
 
-    def gs_profiles_generators_by_queries(self, queries, loading_sp=1, pages_to_load=5, n_gram=2, most_used=20, add2database=True):
+    def run_job(self, queue, job, loading_sp=10, pages_to_load=5, n_gram=2, most_used=20, add2database=True,
+                output='xlsx'):
+        # Take a Job claimed from a JobQueue to the end, from where it was left: a profile already fetched
+        # is not fetched again. The queue is told about every step, or about the failure
+        try:
+            profile = job.profile
+            if profile is None:
+                self.loading_gs_homepage(job.url, loading_sp=loading_sp, pages_to_load=pages_to_load)
+                profile = self.extract_profile()
+                queue.advance(job.url, 'fetched', profile=profile)
+            with self.metrics.stage('analyze'):
+                sheets = profile_sheets(profile, n_gram=n_gram, most_used=most_used)
+            queue.advance(job.url, 'analyzed')
+            queue.advance(job.url, 'written', path=self.write_profile(profile, sheets, add2database=add2database,
+                                                                      output=output))
+        except Exception as e:
+            print(f'Nothing found in {job.url}: {e!r}')
+            queue.fail(job.url, e)
+
+    def gs_profiles_generators_by_queries(self, queries, loading_sp=10, pages_to_load=5, n_gram=2, most_used=20, add2database=True,
+                                          host=GS_HOST):
+        # Return a BatchResult per query, in the order of the queries. A query is a name or a (name, hint) pair
+        # (see AuthorResolver). The queries are resolved together first; those that lead to no single scholar
+        # get a LookupError (or the error of the search), the others are scraped like gs_profiles_generators_by_urls
         if not type(queries) is list:
-            url = gshp_link_by_query(queries)
-            if url is not None:
-                self.loading_gs_homepage(url, loading_sp=loading_sp, pages_to_load=pages_to_load)
-                self.gs_profile_generator(n_gram=n_gram, most_used=most_used, add2database=add2database)
-        else:
-            urls = []
-            for query in queries:
-                url = gshp_link_by_query(query)
-                if url is not None:
-                    urls.append(url)
-            self.gs_profiles_generators_by_urls(urls, loading_sp=loading_sp, pages_to_load=pages_to_load, n_gram=n_gram, most_used=most_used, add2database=add2database)
+            queries = [queries]
+        resolver = AuthorResolver(session=self.session, database=self.database, limiter=self.limiter,
+                                  retries=self.retries, cache=self.cache, host=host, metrics=self.metrics)
+        try:
+            resolutions = resolver.resolve(queries)
+        finally:
+            resolver.close()
+        scraped = iter(self.gs_profiles_generators_by_urls(
+            [r.url for r in resolutions if r.url is not None], loading_sp=loading_sp, pages_to_load=pages_to_load,
+            n_gram=n_gram, most_used=most_used, add2database=add2database))
+        results = []
+        for query, resolution in zip(queries, resolutions):
+            if resolution.url is not None:
+                results.append(next(scraped)._replace(item=query))
+            else:
+                error = resolution_error(resolution)
+                print(f'Nothing found for {query}: {error}')
+                results.append(BatchResult(query, None, None, error))
+        return results
 
     def close(self):
-        self.wd.quit()
+        if self.wd is not None:
+            self.wd.quit()
+        if self.own_session:
+            self.session.close()
+
+
+# The outcome of one item (url or query) of a batch. error is None if the profile was saved to path
+BatchResult = namedtuple('BatchResult', ['item', 'url', 'path', 'error'])
+
+
+def resolution_error(resolution):
+    # The error of a BatchResult for a query not resolved to a GS homepage
+    if resolution.status == 'error':
+        return resolution.candidates[0]
+    return LookupError(f'{len(resolution.candidates)} scholars were found given the input {resolution.query} '
+                       f'({resolution.status})')
+
+
+# A url claimed from a JobQueue. profile is the profile fetched (see GSAnalyzer.extract_profile)
+# if the job got that far before, None otherwise
+Job = namedtuple('Job', ['url', 'state', 'attempts', 'profile'])
+
+
+class JobQueue:
+    """
+    A batch of GS homepage urls kept in a SQLite file, with the state of every url: 'pending', 'fetched'
+    (the profile is kept in the queue until written), 'analyzed', 'written', or 'failed' after max_attempts
+    attempts, along with the number of attempts and the last error. Workers claim the unfinished urls one
+    at a time, so that threads, processes and machines sharing the file can work on the same batch. A url
+    claimed by a worker that died is claimed again after `lease` seconds (the clocks of the machines are
+    assumed to agree), or as soon as the queue is opened again if the worker was a process of the same
+    machine. A url that failed is only claimed again `backoff` seconds later, twice as long after each failure,
+    the other urls being claimed in the meantime. The file uses the rollback journal, as WAL does not work on
+    network filesystems; so should the GSDatabase of a batch shared by several machines (see GSDatabase).
+
+        jobs = JobQueue('/Users/wzx/Downloads/GS Jobs.sqlite')
+        gs_profiles_pipeline(urls, '/Users/wzx/Downloads/', jobs=jobs)
+        jobs.counts()  # {'written': 1990, 'failed': 10}
+    """
+
+    def __init__(self, path, lease=3600, max_attempts=3, backoff=60):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+        self.lock = Lock()
+        # transactions are begun explicitly (see transaction)
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                url TEXT PRIMARY KEY, state TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, error TEXT,
+                path TEXT, profile TEXT, worker TEXT, claimed_at REAL, updated TEXT, retry_at REAL DEFAULT 0
+            )
+        """)
+        # the queues made before the failed urls were backed off
+        if 'retry_at' not in [row[1] for row in self.db.execute('PRAGMA table_info(jobs)')]:
+            self.db.execute('ALTER TABLE jobs ADD COLUMN retry_at REAL DEFAULT 0')
+        self.release_dead()
+
+    def release_dead(self):
+        # Release the urls held by the processes of this machine that are gone (e.g., after a crash)
+        if os.name != 'posix':
+            return
+        host = socket.gethostname()
+        with self.lock:
+            workers = [w for w, in self.db.execute('SELECT DISTINCT worker FROM jobs WHERE worker IS NOT NULL')]
+        dead = []
+        for worker in workers:
+            worker_host, _, pid = worker.rpartition(':')
+            if worker_host != host or not pid.isdigit():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                dead.append((worker,))
+            except PermissionError:
+                pass
+        if dead:
+            with self.transaction() as db:
+                db.executemany('UPDATE jobs SET worker = NULL WHERE worker = ?', dead)
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock of the file at once, so that two workers cannot claim the same url
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+
+    def add(self, urls):
+        # Add the urls not in the queue yet; return how many were added
+        with self.transaction() as db:
+            before = db.total_changes
+            db.executemany('INSERT OR IGNORE INTO jobs (url) VALUES (?)', [(url,) for url in urls])
+            return db.total_changes - before
+
+    def claim(self, wait=True):
+        # The next unfinished url, now held by this worker, as a Job; None if there is nothing left to claim.
+        # The urls that failed before come after the others, once their backoff is over. If only such urls
+        # are left, or urls still held by this worker (which may fail), wait for them (unless not wait)
+        while True:
+            now = time.time()
+            unfinished = "state NOT IN ('written', 'failed') AND (worker IS NULL OR claimed_at < ?)"
+            with self.transaction() as db:
+                row = db.execute(
+                    f'SELECT url, state, attempts, profile FROM jobs WHERE {unfinished} AND retry_at <= ? '
+                    'ORDER BY retry_at, rowid LIMIT 1', (now - self.lease, now)
+                ).fetchone()
+                if row is not None:
+                    db.execute('UPDATE jobs SET worker = ?, claimed_at = ?, attempts = attempts + 1 WHERE url = ?',
+                               (self.worker, now, row[0]))
+                    url, state, attempts, profile = row
+                    return Job(url, state, attempts + 1, json.loads(profile) if profile else None)
+                retry_at = db.execute(f'SELECT MIN(retry_at) FROM jobs WHERE {unfinished}',
+                                      (now - self.lease,)).fetchone()[0]
+                held = db.execute("SELECT COUNT(*) FROM jobs WHERE state NOT IN ('written', 'failed') "
+                                  'AND worker = ? AND claimed_at >= ?', (self.worker, now - self.lease)).fetchone()[0]
+            if not wait or (retry_at is None and not held):
+                return None
+            delay = retry_at - now if retry_at is not None else 0.1
+            time.sleep(max(min(delay, 0.1) if held else delay, 0))
+
+    def advance(self, url, state, profile=None, path=None):
+        # Record that a url got to a state ('fetched' with the profile, 'analyzed', or 'written' with the path).
+        # This also renews the lease; a written url is released
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.transaction() as db:
+            if state == 'written':
+                db.execute('UPDATE jobs SET state = ?, path = ?, profile = NULL, error = NULL, worker = NULL, '
+                           'updated = ? WHERE url = ?', (state, path, now, url))
+            else:
+                db.execute('UPDATE jobs SET state = ?, profile = COALESCE(?, profile), claimed_at = ?, updated = ? '
+                           'WHERE url = ?', (state, json.dumps(profile, default=list) if profile else None, time.time(),
+                                             now, url))
+
+    def fail(self, url, error):
+        # Release a url after an error: it is claimed again after the backoff (backoff * 2 ** (attempts - 1) seconds),
+        # unless it has been tried max_attempts times
+        with self.transaction() as db:
+            db.execute("UPDATE jobs SET error = ?, worker = NULL, updated = ?, "
+                       "retry_at = ? + ? * (1 << (attempts - 1)), "
+                       "state = CASE WHEN attempts >= ? THEN 'failed' ELSE state END WHERE url = ?",
+                       (repr(error), datetime.now().isoformat(timespec='seconds'), time.time(), self.backoff,
+                        self.max_attempts, url))
+
+    def retry_failed(self):
+        # Give the failed urls another max_attempts attempts, from where they were left
+        with self.transaction() as db:
+            db.execute("UPDATE jobs SET attempts = 0, retry_at = 0, "
+                       "state = CASE WHEN profile IS NULL THEN 'pending' ELSE 'fetched' END WHERE state = 'failed'")
+
+    def counts(self):
+        # The number of urls in each state
+        with self.lock:
+            return dict(self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+
+    def results(self, urls=None):
+        # A BatchResult per url (only the given ones, in their order, if any). The error is that of the last
+        # attempt, as a RuntimeError; the urls still to be done have neither a path nor an error
+        with self.lock:
+            rows = {url: (path, error) for url, path, error in
+                    self.db.execute('SELECT url, path, error FROM jobs ORDER BY rowid')}
+        return [BatchResult(url, url, path, RuntimeError(error) if error else None)
+                for url, (path, error) in ((url, rows.get(url, (None, None))) for url in (urls or rows))]
+
+    def close(self):
+        self.db.close()
+
+
+def gs_profiles_pipeline(items, res_dir, by='url', workers=4, backend='http', wd_factory=None,
+                         rate=1.0, burst=1, retries=3, queue_size=None, extraction='bulk', cache=None,
+                         database=None, refresh=False, graph=None, output='xlsx',
+                         loading_sp=10, pages_to_load=5, n_gram=2, most_used=20, add2database=True, metrics=None,
+                         jobs=None, details=False, detail_workers=8):
+    """
+    Scrape many GS homepages concurrently. Query resolution, page fetching, analysis and saving run
+    as separate stages connected by bounded queues, and fetching is shared by a pool of workers.
+    :param items: a list of GS homepage urls, or of queries if by='query'. A query is a name or
+    a (name, hint) pair, the hint (e.g., an affiliation) being used to pick among several scholars (see AuthorResolver)
+    :param by: 'url' or 'query'
+    :param workers: the number of fetching workers, each with its own http session or webdriver
+    :param backend: 'http' or 'selenium'. For 'selenium', wd_factory() must return a new webdriver
+    :param rate: the number of requests per second allowed across all workers (None for no limit)
+    :param burst: the number of requests that can be sent at once when the workers have been idle
+    :param retries: how many times a request is retried on a 429/5xx response or a connection error
+    :param queue_size: the size of the queues between stages (2 * workers by default)
+    :param cache: a ResponseCache shared by the workers
+    :param database: a GSDatabase where the scraped publications and the basic info are kept
+    (GS_DATABASE in res_dir is used for the basic info by default)
+    :param refresh: only load the publications changed since the snapshots in the database
+    :param graph: a CoauthorGraph that every profile is added to
+    :param output: the format of the profiles saved: 'xlsx', 'csv', 'jsonl' or 'parquet'
+    :param metrics: the Metrics shared by every stage and worker (saved as json after each profile if it has a path)
+    :param jobs: a JobQueue, or the path of one, where the urls are added and the progress is saved, so that
+    the batch can be resumed (see resume) and shared with other processes. Only the unfinished urls are scraped
+    :param details: whether the detail page of every publication is crawled too, by detail_workers threads
+    per fetching worker (see PublicationCrawler)
+    :return: a BatchResult for every item, in the order of the input (with jobs, for every url in the queue
+    if there is no item)
+    """
+    if by not in ('url', 'query'):
+        raise ValueError(f"by must be 'url' or 'query', not {by!r}")
+    if jobs is not None and by != 'url':
+        raise ValueError("A JobQueue holds urls: resolve the queries first (see AuthorResolver)")
+    if backend == 'selenium' and wd_factory is None:
+        raise ValueError('wd_factory is needed to create a webdriver per worker')
+    items = [items] if isinstance(items, str) else list(items)
+    res_dir = res_dir if res_dir.endswith('/') else res_dir + '/'
+    results = [None] * len(items)
+    limiter = RateLimiter(rate, burst) if rate else None
+    metrics = metrics if metrics is not None else Metrics()
+    queue_size = queue_size or 2 * workers
+    fetch_q, analyze_q, write_q = Queue(queue_size), Queue(queue_size), Queue(queue_size)
+    done = object()
+    queue = jobs if jobs is None or isinstance(jobs, JobQueue) else JobQueue(jobs)
+    if queue is not None:
+        queue.add(items)
+
+    def finish(i, item, url, path, error):
+        if queue is None:
+            results[i] = BatchResult(item, url, path, error)
+        elif error is None:
+            queue.advance(url, 'written', path=path)
+        else:
+            queue.fail(url, error)
+
+    def resolve():
+        resolver = AuthorResolver(database=database, limiter=limiter, retries=retries, cache=cache, workers=1,
+                                  metrics=metrics)
+        try:
+            if queue is not None:
+                # the urls are claimed as the workers become free
+                for job in iter(queue.claim, None):
+                    fetch_q.put((None, job.url, job.url, job.profile))
+                return
+            for i, item in enumerate(items):
+                if by == 'url':
+                    fetch_q.put((i, item, item, None))
+                    continue
+                with metrics.stage('resolve'):
+                    resolution = resolver.resolve_one(item)
+                if resolution.url is not None:
+                    fetch_q.put((i, item, resolution.url, None))
+                else:
+                    results[i] = BatchResult(item, None, None, resolution_error(resolution))
+        finally:
+            resolver.close()
+            for _ in range(workers):
+                fetch_q.put(done)
+
+    def fetch():
+        g = None
+        try:
+            g = GSAnalyzer(wd_factory() if backend == 'selenium' else None, res_dir, backend=backend,
+                           extraction=extraction, limiter=limiter, retries=retries, cache=cache,
+                           database=database, metrics=metrics)
+            while True:
+                task = fetch_q.get()
+                if task is done:
+                    break
+                i, item, url, profile = task
+                try:
+                    # a profile fetched before the batch was cut short is not fetched again
+                    if profile is None:
+                        g.loading_gs_homepage(url, loading_sp=loading_sp, pages_to_load=pages_to_load,
+                                              refresh=refresh)
+                        profile = g.extract_profile()
+                        if details:
+                            profile['details'] = g.crawl_details(profile, workers=detail_workers, rate=rate, burst=burst)
+                        if queue is not None:
+                            queue.advance(url, 'fetched', profile=profile)
+                    analyze_q.put((i, item, url, profile))
+                except Exception as e:
+                    analyze_q.put((i, item, url, e))
+        except Exception as e:
+            # the worker itself could not be started: fail whatever it would have fetched
+            while True:
+                task = fetch_q.get()
+                if task is done:
+                    break
+                analyze_q.put(task[:3] + (e,))
+        finally:
+            if g is not None:
+                g.close()
+            analyze_q.put(done)
+
+    def analyze():
+        finished = 0
+        while finished < workers:
+            task = analyze_q.get()
+            if task is done:
+                finished += 1
+                continue
+            i, item, url, profile = task
+            if not isinstance(profile, Exception):
+                try:
+                    with metrics.stage('analyze'):
+                        profile = (profile, profile_sheets(profile, n_gram=n_gram, most_used=most_used))
+                    if queue is not None:
+                        queue.advance(url, 'analyzed')
+                except Exception as e:
+                    profile = e
+            write_q.put((i, item, url, profile))
+        write_q.put(done)
+
+    def write():
+        db = database
+        if db is None and add2database:
+            db = GSDatabase(res_dir + GS_DATABASE)
+        while True:
+            task = write_q.get()
+            if task is done:
+                break
+            i, item, url, res = task
+            if isinstance(res, Exception):
+                finish(i, item, url, None, res)
+                continue
+            profile, sheets = res
+            try:
+                path = save_gs_profile(res_dir, profile, sheets, output=output, add2database=add2database,
+                                       database=database, graph=graph, metrics=metrics, info_database=db)
+                finish(i, item, url, path, None)
+            except Exception as e:
+                finish(i, item, url, None, e)
+        if db is not database:
+            db.close()
+
+    threads = [Thread(target=resolve), Thread(target=analyze), Thread(target=write)]
+    threads += [Thread(target=fetch) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if queue is not None:
+        results = queue.results(items)
+        if queue is not jobs:
+            queue.close()
+    return results
+
+
+def resume(jobs, res_dir, **kwargs):
+    # Scrape the unfinished urls of a JobQueue (or of the JobQueue at the path `jobs`) with gs_profiles_pipeline,
+    # e.g., after a crash, or on several machines at once. Return a BatchResult for every url in the queue.
+    # On several machines, pass database=GSDatabase(path, journal_mode='DELETE'): the GSDatabase opened by default
+    # (GS_DATABASE in res_dir) uses WAL, which does not work across machines
+    return gs_profiles_pipeline([], res_dir, jobs=jobs, **kwargs)
+
+
+class AsyncGSAnalyzer:
+    """
+    An asyncio counterpart of GSAnalyzer with the http backend, for embedding in async services (needs aiohttp).
+    The pages are parsed and the profiles analyzed and saved with the same functions as GSAnalyzer; the
+    parsing, analysis and saving run in the default executor so that they do not block the event loop.
+    At most `concurrency` requests are in flight at once, each limited to `timeout` seconds; a cancelled
+    task stops where it is.
+
+        async with AsyncGSAnalyzer('/Users/wzx/Downloads/', concurrency=20) as g:
+            profile = await g.fetch_profile(url)
+            results = await g.gs_profiles_generators_by_urls(urls)
+    """
+
+    def __init__(self, res_dir, concurrency=10, timeout=30, retries=3, backoff=1.0, limiter=None,
+                 session=None, database=None, graph=None, metrics=None):
+        import aiohttp
+        self.aiohttp = aiohttp
+        self.res_dir = res_dir if res_dir.endswith('/') else res_dir + '/'
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = limiter
+        self.own_session = session is None
+        self.session = session
+        self.database = database
+        self.graph = graph
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def get(self, url):
+        # The body of a page, with the same retries as fetch()
+        if self.session is None:
+            self.session = self.aiohttp.ClientSession(headers=HEADERS)
+        for attempt in range(self.retries + 1):
+            if self.limiter is not None:
+                await asyncio.sleep(self.limiter.reserve())
+            self.metrics.count('requests')
+            if attempt:
+                self.metrics.count('retries')
+            try:
+                async with self.semaphore:
+                    async with self.session.get(url, timeout=self.aiohttp.ClientTimeout(total=self.timeout)) as r:
+                        if r.status not in RETRY_STATUS or attempt == self.retries:
+                            r.raise_for_status()
+                            body = await r.read()
+                            self.metrics.count('bytes', len(body))
+                            return body
+                        retry_after = r.headers.get('Retry-After', '')
+            except (self.aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+                retry_after = ''
+            await asyncio.sleep(int(retry_after) if retry_after.isdigit() else self.backoff * 2 ** attempt)
+
+    async def soup(self, url):
+        return await self.run(bs, await self.get(url), 'html.parser')
+
+    async def fetch_profile(self, url, pages_to_load=5):
+        # The profile of a GS homepage, as returned by GSAnalyzer.extract_profile.
+        # The 'load' stage is the time between the first request and the last page parsed
+        start = time.perf_counter()
+        soup = await self.soup(gs_page_url(url, 0))
+        rows = parse_publication_rows(soup, url)
+        pages_loaded = 0
+        while pages_loaded < pages_to_load and rows and len(rows) % GS_PAGESIZE == 0:
+            page = parse_publication_rows(await self.soup(gs_page_url(url, len(rows))), url)
+            if not page:
+                break
+            rows.extend(page)
+            pages_loaded += 1
+        self.metrics.add_stage('load', time.perf_counter() - start)
+        self.metrics.count('pages', pages_loaded + 1)
+        self.metrics.count('rows', len(rows))
+        name, affiliation, homepage, specialization, all_citation, past5y_citation = parse_basic_info(soup)
+        date = datetime.now().strftime('%Y-%m-%d')
+        return {
+            'info': [name, affiliation, homepage, url, specialization, all_citation, past5y_citation, date],
+            'citation_by_year': parse_citation_by_year(soup),
+            'publications': PublicationTable(rows)
+        }
+
+    def save_profile(self, profile, n_gram, most_used, add2database, output):
+        with self.metrics.stage('analyze'):
+            sheets = profile_sheets(profile, n_gram=n_gram, most_used=most_used)
+        return save_gs_profile(self.res_dir, profile, sheets, output=output, add2database=add2database,
+                               database=self.database, graph=self.graph, metrics=self.metrics)
+
+    async def gs_profile_generator(self, url, pages_to_load=5, n_gram=2, most_used=20, add2database=True,
+                                   output='xlsx'):
+        # Fetch, analyze and save a profile like GSAnalyzer.gs_profile_generator. Return the path saved
+        profile = await self.fetch_profile(url, pages_to_load=pages_to_load)
+        return await self.run(self.save_profile, profile, n_gram, most_used, add2database, output)
+
+    async def gs_profiles_generators_by_urls(self, urls, pages_to_load=5, n_gram=2, most_used=20,
+                                             add2database=True, output='xlsx'):
+        # A BatchResult per url, in the order of the urls. The profiles are fetched concurrently
+        async def one(url):
+            try:
+                return BatchResult(url, url, await self.gs_profile_generator(
+                    url, pages_to_load, n_gram, most_used, add2database, output), None)
+            except Exception as e:
+                return BatchResult(url, url, None, e)
+        return await asyncio.gather(*[one(url) for url in urls])
+
+    async def close(self):
+        if self.own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+async def gshp_link_by_query_async(query, analyzer, host=GS_HOST):
+    # Find a researcher's Google Scholar homepage link by a query, with the session of an AsyncGSAnalyzer.
+    # Return None unless exactly one scholar is found
+    kw = '+'.join(query.split())
+    search_link = host + '/citations?hl=en&view_op=search_authors&mauthors=' + kw
+    candidates = parse_author_search(await analyzer.soup(search_link), search_link)
+    return candidates[0].url if len(candidates) == 1 else None
@@ -0,0 +1,967 @@
+"""
+Offline benchmarks for GSAnalyzer. Synthetic GS homepages are generated locally (and served by a
+local http server when needed), so no network access or browser is required. The fixture pages are
+the same from run to run, so the timings can be compared against a baseline, e.g., in CI:
+
+    python benchmark.py --save baseline.json
+    python benchmark.py --baseline baseline.json --tolerance 1.5
+
+The second run fails (exit code 1) if any benchmark is more than 1.5 times slower than the baseline.
+The checks (which assert that the features behave as documented, on the same fixtures) run with:
+
+    python benchmark.py --check
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import sys
+import http.server
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+
+from bs4 import BeautifulSoup as bs
+
+import pandas as pd
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+
+from GSAnalyzer import GSAnalyzer, xpath_to_css, visible_text, profile_sheets, write_gs_profile, SINKS, \
+    filtered_ngram, counter, NgramEngine, titles_ngram_analysis, authors_analysis, num_of_pub_by_year, gs_profiles_pipeline, Metrics, GSDatabase, Cohort, \
+    PublicationTable, PublicationCrawler, ResponseCache, fetch, gs_session, AuthorResolver, search_gs_authors, \
+    AsyncGSAnalyzer, gshp_link_by_query_async, CoauthorGraph, JobQueue, resume, gs_profile_database, GS_DATABASE
+
+
+def fixture_citations(i):
+    # The citations of the i-th publication of the fixture pages, the same whatever the number of publications
+    return 10000 - i
+
+
+def fixture_page(n_pubs, cstart=0, pagesize=20, name='Ronald A. Fisher', user='FIXTURE0AAAAJ', sortby=None):
+    # A GS homepage with n_pubs synthetic publications, of which [cstart, cstart + pagesize) are shown.
+    # As on GS, the "show more" button is disabled when the last publication is shown.
+    # The publications are listed by citations, or the last added first with sortby='pubdate'
+    rows = []
+    order = range(n_pubs - 1, -1, -1) if sortby == 'pubdate' else range(n_pubs)
+    for i in order[cstart:cstart + pagesize]:
+        year = 1920 + i % 50
+        rows.append(
+            f'<tr class="gsc_a_tr"><td class="gsc_a_t">'
+            f'<a href="javascript:void(0)" class="gsc_a_at" data-href="/citations?view_op=view_citation'
+            f'&amp;hl=en&amp;user={user}&amp;citation_for_view={user}:{i:06d}">'
+            f'On the statistical design of experiments {i} in agricultural genetics</a>'
+            f'<div class="gs_gray">RA Fisher, F Yates, WA Mackenzie{i % 7}</div>'
+            f'<div class="gs_gray">Journal of Agricultural Science {i % 5}'
+            f'<span class="gs_oph">, {year}</span></div></td>'
+            f'<td class="gsc_a_c"><a href="#" class="gsc_a_ac gs_ibl">{fixture_citations(i)}</a></td>'
+            f'<td class="gsc_a_y"><span class="gsc_a_h gsc_a_hc gs_ibl">{year}</span></td></tr>'
+        )
+    if not rows:
+        rows.append('<tr class="gsc_a_tr"><td class="gsc_a_e" colspan="3">'
+                    'There are no articles in this profile.</td></tr>')
+    years = range(2014, 2022)
+    hist = ''.join(f'<span class="gsc_g_t">{y}</span>' for y in years) + \
+        ''.join(f'<a href="#" class="gsc_g_a"><span class="gsc_g_al">{(y - 2000) * 100}</span></a>' for y in years)
+    return (
+        f'<html><body><div id="gsc_prf_i"><div id="gsc_prf_in">{name}</div>'
+        f'<div class="gsc_prf_il"><a href="/citations?view_op=view_org">University College London</a></div>'
+        f'<div class="gsc_prf_il" id="gsc_prf_ivh">Verified email at ucl.ac.uk - '
+        f'<a href="http://example.org/" rel="nofollow">Homepage</a></div>'
+        f'<div class="gsc_prf_il" id="gsc_prf_int"><a href="#">Statistics</a><a href="#">Genetics</a></div></div>'
+        f'<table id="gsc_rsb_st"><thead><tr><th></th><th>All</th><th>Since 2016</th></tr></thead><tbody>'
+        f'<tr><td>Citations</td><td class="gsc_rsb_std">{n_pubs * 100}</td><td class="gsc_rsb_std">{n_pubs * 20}</td></tr>'
+        f'<tr><td>h-index</td><td class="gsc_rsb_std">{n_pubs // 10}</td><td class="gsc_rsb_std">{n_pubs // 20}</td></tr>'
+        f'</tbody></table>'
+        f'<div id="gsc_rsb_cit"><div><div class="gsc_md_hist_w"><div class="gsc_md_hist_b">{hist}</div></div></div></div>'
+        f'<table id="gsc_a_t"><tbody id="gsc_a_b">{"".join(rows)}</tbody></table>'
+        f'<button id="gsc_bpf_more"{" disabled" if cstart + pagesize >= n_pubs else ""}><span><span></span><span>Show more</span></span></button></body></html>'
+    )
+
+
+def fixture_detail_page(user, i, n_pubs):
+    # The detail page of the i-th publication of fixture_page, with the full author list and a citation histogram
+    year = 1920 + i % 50
+    bars = ''.join(
+        f'<span class="gsc_oci_g_t">{y}</span>' for y in range(2014, 2022)
+    ) + ''.join(
+        f'<a href="/scholar?oi=bibs&amp;cites=1{i}&amp;as_sdt=5&amp;as_ylo={y}&amp;as_yhi={y}" class="gsc_oci_g_a">'
+        f'<span class="gsc_oci_g_al">{fixture_citations(i) * (y - 2013) // 36}</span></a>'
+        for y in range(2014, 2022) if y % 3
+    )
+    fields = [
+        ('Authors', f'RA Fisher, F Yates, WA Mackenzie{i % 7}, WG Cochran, CR Rao'),
+        ('Publication date', f'{year}/1/1'),
+        ('Journal', f'Journal of Agricultural Science {i % 5}'),
+        ('Description', f'<div id="gsc_oci_descr"><div class="gsh_csp">We study experiment {i} in the field.</div></div>'),
+        ('Total citations', f'<div><a href="/scholar?cites=1{i}">Cited by {fixture_citations(i)}</a></div>'
+                            f'<div id="gsc_oci_graph_bars">{bars}</div>')
+    ]
+    table = ''.join(f'<div class="gs_scl"><div class="gsc_oci_field">{field}</div>'
+                    f'<div class="gsc_oci_value">{value}</div></div>' for field, value in fields)
+    return (f'<html><body><div id="gsc_oci_title"><a class="gsc_oci_title_link" href="#">'
+            f'On the statistical design of experiments {i} in agricultural genetics</a></div>'
+            f'<div id="gsc_oci_table">{table}</div></body></html>')
+
+
+def fixture_search_page(query):
+    # A GS author search page: no scholar for a query with "nobody", two namesakes at different
+    # universities for a query with "fisher", one scholar otherwise
+    name = ' '.join(query.split())
+    if 'nobody' in name.lower():
+        people = []
+    elif 'fisher' in name.lower():
+        people = [(name, 'University College London', 'ucl.ac.uk', ['Statistics', 'Genetics'], 'FISHER01AAAJ'),
+                  (name, 'Massachusetts Institute of Technology', 'mit.edu', ['Physics'], 'FISHER02AAAJ')]
+    else:
+        people = [(name, 'Bell Labs', 'bell-labs.com', ['Information Theory'], 'SHANNON1AAAJ')]
+    users = ''.join(
+        f'<div class="gsc_1usr"><div class="gs_ai gs_scl gs_ai_chpr"><div class="gs_ai_t">'
+        f'<h3 class="gs_ai_name"><a href="/citations?hl=en&amp;user={user}">{person}</a></h3>'
+        f'<div class="gs_ai_aff">{aff}</div><div class="gs_ai_eml">Verified email at {email}</div>'
+        f'<div class="gs_ai_cby">Cited by {1000 * (i + 1)}</div>'
+        f'<div class="gs_ai_int">{"".join(f"<a class=gs_ai_one_int>{x}</a>" for x in interests)}</div>'
+        f'</div></div></div>'
+        for i, (person, aff, email, interests, user) in enumerate(people)
+    )
+    return f'<html><body><div id="gsc_sa_ccl">{users}</div></body></html>'
+
+
+def serve_fixtures(n_pubs=500):
+    # Serve fixture homepages and author searches on a local port, honouring the cstart/pagesize parameters
+    # like GS does and answering conditional requests with 304 when the page has not changed.
+    # Returns the server; the homepage url is f'http://127.0.0.1:{server.server_port}/citations?user=...'
+    # and server.n_pubs can be changed to simulate new publications (the publications are listed by citations,
+    # or the last added first with sortby=pubdate). The detail pages of the publications
+    # are served after server.latency seconds, like a remote server would, and the homepages after
+    # server.page_latency seconds. The homepages of the users whose id starts with server.missing ('MISSING')
+    # are not found (404).
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            if query.get('view_op') == ['search_authors']:
+                return self.send_body(fixture_search_page(query['mauthors'][0]).encode())
+            if query.get('view_op') == ['view_citation']:
+                time.sleep(self.server.latency)
+                user, i = query['citation_for_view'][0].split(':')
+                return self.send_body(fixture_detail_page(user, int(i), self.server.n_pubs).encode())
+            cstart = int(query.get('cstart', ['0'])[0])
+            pagesize = int(query.get('pagesize', ['20'])[0])
+            user = query.get('user', ['FIXTURE0AAAAJ'])[0]
+            if self.server.missing and user.startswith(self.server.missing):
+                return self.send_error(404)
+            time.sleep(self.server.page_latency)
+            sortby = query.get('sortby', [None])[0]
+            # every scholar but the default one is numbered, so that their profiles are saved in different files
+            name = 'Ronald A. Fisher'
+            if user != 'FIXTURE0AAAAJ':
+                name += ' ' + ''.join(filter(str.isdigit, user))
+            self.send_body(fixture_page(self.server.n_pubs, cstart, pagesize, name=name, user=user,
+                                        sortby=sortby).encode())
+
+        def send_body(self, body):
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # the client gave up: timed out, cancelled or killed
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    class Server(http.server.ThreadingHTTPServer):
+        # the default backlog (5) drops the connections of more than a few concurrent workers
+        request_queue_size = 128
+
+    server = Server(('127.0.0.1', 0), Handler)
+    server.n_pubs = n_pubs
+    server.latency = 0
+    server.page_latency = 0
+    server.missing = 'MISSING'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FixtureElement:
+
+    def __init__(self, tag, driver):
+        self.tag = tag
+        self.driver = driver
+
+    @property
+    def text(self):
+        self.driver.call()
+        return visible_text(self.tag)
+
+    def get_attribute(self, name):
+        self.driver.call()
+        return self.tag.get(name)
+
+    def click(self):
+        self.driver.call()
+        self.driver.clicked(self.tag)
+
+
+class FixtureDriver:
+    # Stands in for a selenium webdriver on a fully loaded fixture page. Every call is counted and
+    # delayed by `latency` seconds, which is roughly what a round-trip to a local chromedriver costs.
+
+    def __init__(self, html, latency=0.0005):
+        self.html = html
+        self.soup = bs(html, 'html.parser')
+        self.latency = latency
+        self.calls = 0
+
+    def call(self):
+        self.calls += 1
+        time.sleep(self.latency)
+
+    def get(self, url):
+        self.call()
+
+    @property
+    def page_source(self):
+        self.call()
+        return self.html
+
+    def find_elements(self, by, value):
+        # by is By.CLASS_NAME or By.XPATH
+        self.call()
+        css = '.' + value if by == By.CLASS_NAME else xpath_to_css(value)
+        return [FixtureElement(t, self) for t in self.soup.select(css)]
+
+    def find_element(self, by, value):
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f'No element found by {value}')
+        return elements[0]
+
+    def clicked(self, tag):
+        pass
+
+    def quit(self):
+        pass
+
+
+class LoadingFixtureDriver(FixtureDriver):
+    # A FixtureDriver for a GS homepage being loaded: the first page holds the `pagesize` of the url
+    # (20 by default), and each click on "show more" shows `step` more publications `render` seconds later.
+    # The whole page is parsed once, only the rows shown and the button are looked up while loading
+
+    def __init__(self, n_pubs, render=0.3, step=100, latency=0.0005):
+        super().__init__(fixture_page(n_pubs, pagesize=n_pubs), latency=latency)
+        self.n_pubs = n_pubs
+        self.render = render
+        self.step = step
+        self.rows = self.soup.select('.gsc_a_tr')
+        self.button = self.soup.select_one('#gsc_bpf_more')
+        self.due = None
+        self.show(20)
+
+    def show(self, n):
+        self.shown = min(n, self.n_pubs)
+        self.html = fixture_page(self.n_pubs, pagesize=self.shown)
+        if self.shown < self.n_pubs:
+            self.button.attrs.pop('disabled', None)
+        else:
+            self.button['disabled'] = ''
+
+    def find_elements(self, by, value):
+        if (by, value) != (By.CLASS_NAME, 'gsc_a_tr'):
+            return super().find_elements(by, value)
+        self.call()
+        return [FixtureElement(t, self) for t in self.rows[:self.shown]]
+
+    def call(self):
+        super().call()
+        if self.due is not None and time.monotonic() >= self.due:
+            self.due = None
+            self.show(self.shown + self.step)
+
+    def get(self, url):
+        super().get(url)
+        self.due = None
+        self.show(int(parse_qs(urlparse(url).query).get('pagesize', ['20'])[0]))
+
+    def clicked(self, tag):
+        if self.due is None and self.shown < self.n_pubs:
+            self.due = time.monotonic() + self.render
+
+
+def bench_extraction(n_pubs=500, latency=0.0005):
+    # WebDriver calls and wall time of the basic and publication info, per extraction mode
+    server = serve_fixtures(n_pubs)
+    url = f'http://127.0.0.1:{server.server_port}/citations?user=FIXTURE0AAAAJ&hl=en'
+    html = fixture_page(n_pubs, pagesize=n_pubs)
+    results = {}
+    for extraction in ('xpath', 'bulk'):
+        wd = FixtureDriver(html, latency=latency)
+        g = GSAnalyzer(wd, '.', extraction=extraction)
+        g.url = url
+        start = time.perf_counter()
+        g.gs_basic_info()
+        rows = list(g.gs_publication_info())
+        results[extraction] = (wd.calls, time.perf_counter() - start, rows)
+    server.shutdown()
+
+    assert results['xpath'][2] == results['bulk'][2], 'The extraction modes disagree'
+    print(f'Extraction of a {n_pubs}-publication profile '
+          f'(simulated WebDriver latency: {latency * 1000:.1f} ms per call)')
+    for extraction, (calls, seconds, _) in results.items():
+        print(f'  {extraction:>5}: {calls:>5} WebDriver calls, {seconds:.3f} s')
+    return results
+
+
+def bench_loading(n_pubs=1000, render=0.3, loading_sp=1):
+    # Time to load a whole homepage by clicking "show more", against a fixed `loading_sp` sleep per click
+    wd = LoadingFixtureDriver(n_pubs, render=render)
+    g = GSAnalyzer(wd, '.')
+    start = time.perf_counter()
+    timings = g.loading_gs_homepage('https://scholar.google.com/citations?user=FIXTURE0AAAAJ&hl=en',
+                                    loading_sp=loading_sp, pages_to_load=None)
+    seconds = time.perf_counter() - start
+    assert wd.shown == n_pubs and len(g.publication_rows()) == n_pubs, 'The homepage is not fully loaded'
+
+    clicks = len(timings) - 1
+    print(f'Loading a {n_pubs}-publication profile ({clicks} clicks, {render * 1000:.0f} ms to show a page)')
+    print(f'  adaptive: {seconds:.3f} s, {wd.calls} WebDriver calls')
+    print(f'     fixed: at least {clicks * loading_sp:.3f} s (a {loading_sp} s sleep per click)')
+    return timings, seconds
+
+
+def synthetic_profile(n_pubs=5000, user='FIXTURE0AAAAJ'):
+    # A profile as returned by GSAnalyzer.extract_profile, parsed from a fixture page
+    g = GSAnalyzer(None, '.', backend='http')
+    g.url = f'https://scholar.google.com/citations?user={user}&hl=en'
+    g.soup = bs(fixture_page(n_pubs, pagesize=n_pubs, user=user), 'html.parser')
+    profile = g.extract_profile()
+    g.close()
+    return profile
+
+
+def write_with_pandas(res_dir, profile, sheets):
+    # How the profiles were written before the sinks: a DataFrame per sheet, then pd.ExcelWriter
+    path = f'{res_dir}pandas.xlsx'
+    with pd.ExcelWriter(path) as writer:
+        for name, header, rows, index in sheets:
+            rows = list(rows)
+            if index:
+                pd.Series([r[1] for r in rows], index=[r[0] for r in rows]).to_excel(writer, sheet_name=name,
+                                                                                      header=False)
+            else:
+                pd.DataFrame(rows, columns=header).to_excel(writer, sheet_name=name, index=False,
+                                                             header=header is not None)
+    return path
+
+
+def read_cells(path, rows=None):
+    # The values and the bold flags of the cells of a workbook (of the first rows only, if given)
+    from openpyxl import load_workbook
+    wb = load_workbook(path)
+    return {ws.title: [[(c.value, bool(c.font.b)) for c in row] for row in ws.iter_rows(max_row=rows)] for ws in wb}
+
+
+def values(cells):
+    return {sheet: [[v for v, _ in row] for row in rows] for sheet, rows in cells.items()}
+
+
+# The output of an earlier version, kept in this repository
+SAMPLE_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '【Sample_Output】Ronald A. Fisher GSProfile_2021-04-27.xlsx')
+
+
+def bench_writers(n_pubs=5000):
+    # Wall time and peak memory of writing a profile with pandas and with each sink
+    profile = synthetic_profile(n_pubs)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        res_dir = tmp + os.sep
+        writers = [('pandas', lambda sheets: write_with_pandas(res_dir, profile, sheets))]
+        writers += [(output, lambda sheets, output=output: write_gs_profile(res_dir, profile, sheets, output=output))
+                    for output in SINKS]
+        for name, write in writers:
+            try:
+                tracemalloc.start()
+                start = time.perf_counter()
+                path = write(profile_sheets(profile))
+                seconds = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+            except ImportError as e:
+                print(f'  {name:>7}: skipped ({e})')
+                continue
+            finally:
+                tracemalloc.stop()
+            results[name] = (seconds, peak, path)
+        # the same values as pandas, and the same sheets, headers and header styles as the sample output
+        # (recent pandas versions no longer make the headers bold)
+        assert values(read_cells(results['pandas'][2])) == values(read_cells(results['xlsx'][2])), \
+            'The workbooks differ'
+        if os.path.exists(SAMPLE_OUTPUT):
+            assert read_cells(SAMPLE_OUTPUT, rows=1) == read_cells(results['xlsx'][2], rows=1), \
+                'The headers differ from the sample output'
+
+    print(f'Writing a {n_pubs}-publication profile')
+    for name, (seconds, peak, _) in results.items():
+        print(f'  {name:>7}: {seconds:.3f} s, peak memory {peak / 2 ** 20:.1f} MiB')
+    return results
+
+
+def best_of(func, repeat=5):
+    # The shortest wall time of `repeat` calls, which is the least disturbed by the rest of the machine
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_analysis(n_pubs=5000, n_gram=2, most_used=20, repeat=5):
+    # Wall time of each analysis of a profile's publications
+    profile = synthetic_profile(n_pubs)
+    titles = [p[0] for p in profile['publications']]
+    authors = [p[2] for p in profile['publications']]
+    years = [p[4] for p in profile['publications']]
+    grams = filtered_ngram(titles, n_gram)
+    table = PublicationTable(profile['publications'])
+    results = {
+        'filtered_ngram': best_of(lambda: (filtered_ngram(titles, 1), filtered_ngram(titles, n_gram)), repeat),
+        'counter': best_of(lambda: counter(grams, most_used), repeat),
+        'titles_ngram_analysis': best_of(lambda: list(titles_ngram_analysis(titles, n_gram, most_used)), repeat),
+        'authors_analysis': best_of(lambda: authors_analysis(authors, profile['info'][0]), repeat),
+        'num_of_pub_by_year': best_of(lambda: num_of_pub_by_year(years), repeat),
+        'publication_table': best_of(lambda: PublicationTable(profile['publications']), repeat),
+        'table.authors_analysis': best_of(lambda: table.authors_analysis(profile['info'][0]), repeat),
+        'table.num_of_pub_by_year': best_of(table.num_of_pub_by_year, repeat),
+        'profile_sheets': best_of(lambda: profile_sheets(profile, n_gram, most_used), repeat)
+    }
+    print(f'Analysis of a {n_pubs}-publication profile (best of {repeat})')
+    for name, seconds in results.items():
+        print(f'  {name:>24}: {seconds * 1000:.1f} ms')
+    return results
+
+
+def bench_pipeline(n_profiles=8, n_pubs=500, workers=4, output='xlsx'):
+    # The metrics of gs_profiles_pipeline scraping, analyzing and saving profiles from the fixture server
+    server = serve_fixtures(n_pubs)
+    urls = [f'http://127.0.0.1:{server.server_port}/citations?user=FIXTURE{i:02d}AAAJ&hl=en'
+            for i in range(n_profiles)]
+    metrics = Metrics()
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        results = gs_profiles_pipeline(urls, tmp, workers=workers, rate=None, output=output,
+                                       add2database=False, metrics=metrics)
+        seconds = time.perf_counter() - start
+    server.shutdown()
+    errors = [r.error for r in results if r.error is not None]
+    assert not errors, f'{len(errors)} profiles failed, e.g., {errors[0]!r}'
+
+    print(f'Pipeline of {n_profiles} {n_pubs}-publication profiles ({workers} workers, {output}): {seconds:.3f} s')
+    metrics.report()
+    return seconds, metrics.as_dict()
+
+
+def bench_details(n_pubs=100, latency=0.05, workers=16):
+    # Crawling the detail pages of a profile, one at a time and by `workers` threads (the fixture server taking
+    # `latency` seconds per page), then again with nothing changed since the last crawl
+    server = serve_fixtures(n_pubs)
+    server.latency = latency
+    g = GSAnalyzer(None, '.', backend='http')
+    g.loading_gs_homepage(f'http://127.0.0.1:{server.server_port}/citations?user=FIXTURE0AAAAJ&hl=en',
+                          pages_to_load=None)
+    profile = g.extract_profile()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = GSDatabase(os.path.join(tmp, 'details.sqlite'))
+        for name, n, database in [('serial', 1, None), ('parallel', workers, db), ('unchanged', workers, db)]:
+            # the local server needs no throttling
+            crawler = PublicationCrawler(database=database, workers=n, rate=None)
+            start = time.perf_counter()
+            details = crawler.crawl(profile)
+            results[name] = (time.perf_counter() - start, crawler.metrics.counters['requests'])
+            crawler.close()
+            assert all(d is not None and len(d.authors) == 5 for d in details), 'Some details are missing'
+        db.close()
+    server.shutdown()
+    g.close()
+
+    print(f'Crawling the detail pages of a {n_pubs}-publication profile ({latency * 1000:.0f} ms per page)')
+    for name, (seconds, requests) in results.items():
+        print(f'  {name:>9}: {seconds:.3f} s, {requests} requests')
+    return results
+
+
+def synthetic_database(path, n_scholars=10000, n_pubs=50):
+    # A GSDatabase with the snapshots of n_scholars synthetic scholars, as saved by save_snapshot
+    # (the rows are inserted at once, which is much faster than a snapshot at a time)
+    db = GSDatabase(path)
+    affiliations = ['University College London', 'Rothamsted', 'Cambridge', 'MIT', 'Bell Labs']
+    interests = ['Statistics', 'Genetics', 'Biology', 'Physics', 'Information Theory', 'Agriculture']
+    with db.db:
+        for s in range(n_scholars):
+            user = f'S{s:07d}AAAJ'
+            url = f'https://scholar.google.com/citations?user={user}&hl=en'
+            name = f'Ronald A. Fisher{s}'
+            db.db.execute('INSERT INTO scholars VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+                url, name, affiliations[s % 5], '', f'{interests[s % 6]}; {interests[(s + 1) % 6]}', '', '',
+                '2021-04-27'))
+            db.db.execute('INSERT INTO snapshots VALUES (?, ?, ?, ?, ?)', (user, url, name, '2021-04-27', n_pubs))
+            # RA Fisher{s} is the 2nd author, the 1st, then not an author
+            db.db.executemany('INSERT INTO publications VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+                (user, f'{url}:{i}', i, f'Title {i}', ', '.join(['F Yates', f'RA Fisher{s}', 'WA Mackenzie'][i % 3:]),
+                str((s * 7 + i * 13) % 200), str(1920 + i % 50), '', '2021-04-27', '2021-04-27', [2, 1, 0][i % 3])
+                for i in range(n_pubs)])
+            db.db.executemany('INSERT INTO citations_by_year VALUES (?, ?, ?)',
+                              [(user, y, (s % 100 + 1) * (y - 2000)) for y in range(2014, 2022)])
+    return db
+
+
+def bench_cohort(n_scholars=10000, n_pubs=50):
+    # Loading a cohort of n_scholars from a GSDatabase, then computing the metrics of all of them
+    # (the total is the time from the database to the metrics)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = synthetic_database(os.path.join(tmp, 'cohort.sqlite'), n_scholars, n_pubs)
+        start = time.perf_counter()
+        cohort = Cohort.from_database(db)
+        load = time.perf_counter() - start
+        db.close()
+    start = time.perf_counter()
+    cohort.metrics()
+    cohort.author_positions()
+    cohort.pubs_per_year()
+    cohort.group_by('affiliation')
+    cohort.group_by('specialization')
+    seconds = time.perf_counter() - start
+    print(f'Cohort of {n_scholars} scholars ({n_scholars * n_pubs} publications)')
+    print(f'     load: {load:.3f} s')
+    print(f'  metrics: {seconds:.3f} s')
+    print(f'    total: {load + seconds:.3f} s')
+    return load, seconds
+
+
+def check_cache():
+    # ResponseCache: fresh pages are served without a request, stale ones are revalidated (the fixture server
+    # answers 304), each view_op has its own TTL, and the least recently used pages are evicted first
+    server = serve_fixtures(20)
+    base = f'http://127.0.0.1:{server.server_port}/citations?'
+    homepage = base + 'user=FIXTURE0AAAAJ&hl=en'
+    search = base + 'hl=en&view_op=search_authors&mauthors=Claude+Shannon'
+    session = gs_session()
+    with tempfile.TemporaryDirectory() as tmp:
+        # the homepages are stale at once, the searches are kept for a week (the default)
+        cache = ResponseCache(os.path.join(tmp, 'cache.sqlite'), ttls={'': 0})
+        assert cache.ttl(homepage) == 0 and cache.ttl(search) == ResponseCache.TTLS['search_authors']
+        metrics = Metrics()
+        pages = [fetch(session, url, cache=cache, metrics=metrics).content for url in (homepage, search)]
+        assert metrics.counters['requests'] == 2 and cache.stats()['misses'] == 2
+        # the parameters in another order are the same page
+        assert fetch(session, base + 'mauthors=Claude+Shannon&view_op=search_authors&hl=en', cache=cache,
+                     metrics=metrics).content == pages[1]
+        assert metrics.counters['requests'] == 2 and metrics.counters['cache_hits'] == 1
+        # the stale homepage is asked for again, and the server says it has not changed
+        assert fetch(session, homepage, cache=cache, metrics=metrics).content == pages[0]
+        stats = cache.stats()
+        assert metrics.counters['requests'] == 3 and stats['revalidated'] == 1 and stats['misses'] == 2
+        cache.close()
+
+        # room for two of the three searches: the one not used since it was stored goes first
+        size = len(fetch(session, search).content)
+        cache = ResponseCache(os.path.join(tmp, 'lru.sqlite'), max_bytes=2 * size + size // 2)
+        searches = [base + f'hl=en&view_op=search_authors&mauthors=Claude+Shannon{i}' for i in range(3)]
+        for url in searches[:2]:
+            fetch(session, url, cache=cache)
+        fetch(session, searches[0], cache=cache)
+        fetch(session, searches[2], cache=cache)
+        assert cache.lookup(searches[1]) is None and cache.lookup(searches[0]) is not None
+        assert cache.lookup(searches[2]) is not None and cache.stats()['evictions'] == 1
+        cache.close()
+    session.close()
+    server.shutdown()
+
+
+def check_database():
+    # GSDatabase: the basic info is upserted by GS url (a namesake is another scholar), gs_profile_database says
+    # whether the scholar was added or updated, and the excel export can be imported back as it was
+    fisher = ['Ronald A. Fisher', 'University College London', '', 'https://scholar.google.com/citations?user=FISHER',
+              'Statistics; Genetics', '26480', '1520', '2021-04-27']
+    shannon = ['Claude E Shannon', 'Bell Labs', 'https://bell-labs.com',
+               'https://scholar.google.com/citations?user=SHANNON', 'Information Theory', '150000', '20000',
+               '2021-04-27']
+    namesake = ['Ronald A. Fisher', 'MIT', '', 'https://scholar.google.com/citations?user=FISHER2',
+                'Physics', '12', '3', '2021-04-28']
+    with tempfile.TemporaryDirectory() as tmp:
+        res_dir = tmp + '/'
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            gs_profile_database(res_dir, fisher)
+            gs_profile_database(res_dir, shannon)
+            gs_profile_database(res_dir, fisher[:5] + ['27000', '1600', '2021-05-01'])
+            gs_profile_database(res_dir, namesake)
+        path = res_dir + GS_DATABASE
+        assert out.getvalue().splitlines() == [f'Ronald A. Fisher added to {path}!',
+                                               f'Claude E Shannon added to {path}!',
+                                               f'Ronald A. Fisher updated in {path}!',
+                                               f'Ronald A. Fisher added to {path}!']
+        db = GSDatabase(path)
+        expected = [tuple(fisher[:5] + ['27000', '1600', '2021-05-01']), tuple(shannon), tuple(namesake)]
+        assert db.scholars() == expected
+        # a database given is left open
+        with contextlib.redirect_stdout(io.StringIO()):
+            gs_profile_database(res_dir, shannon, database=db)
+        assert db.upsert_scholar(shannon) is False and len(db.scholars()) == 3
+
+        xlsx = os.path.join(tmp, 'Aggregated GS Database.xlsx')
+        with contextlib.redirect_stdout(io.StringIO()):
+            db.export_excel(xlsx)
+        db.close()
+        imported = GSDatabase(os.path.join(tmp, 'imported.sqlite'))
+        imported.import_excel(xlsx)
+        imported.import_excel(xlsx)
+        assert imported.scholars() == expected
+        imported.close()
+
+
+def check_refresh():
+    # A refresh stops at the first page of unchanged publications, and still finds the publication added since
+    # the snapshot although it comes last: the result is the same as loading the whole homepage again
+    server = serve_fixtures(250)
+    url = f'http://127.0.0.1:{server.server_port}/citations?user=FIXTURE0AAAAJ&hl=en'
+    with tempfile.TemporaryDirectory() as tmp:
+        db = GSDatabase(os.path.join(tmp, 'refresh.sqlite'))
+        g = GSAnalyzer(None, tmp, backend='http', database=db)
+        g.loading_gs_homepage(url, pages_to_load=None)
+        db.save_snapshot(g.extract_profile())
+        server.n_pubs = 251
+        before = g.metrics.counters['requests']
+        g.loading_gs_homepage(url, pages_to_load=None, refresh=True)
+        refreshed = g.extract_profile()['publications']
+        # the first page by citations and the first page by date, instead of 3 pages
+        assert g.metrics.counters['requests'] - before == 2
+        assert len(refreshed) == 251 and refreshed.link(250).endswith(':000250')
+        g.loading_gs_homepage(url, pages_to_load=None)
+        assert list(refreshed) == list(g.extract_profile()['publications'])
+        g.close()
+        db.close()
+    server.shutdown()
+
+
+def check_ngrams():
+    # NgramEngine counts and ranks the n-grams like counter(filtered_ngram(...)), for one scholar or several
+    titles = synthetic_profile(300)['publications'].titles + [
+        'A', 'The of', 'Statistical methods for research workers', 'the design of experiments',
+        'Statistical Methods and Scientific Inference', 'methods for research workers'
+    ]
+    engine = NgramEngine()
+    engine.add('fisher', titles)
+    engine.add('yates', titles[::7])
+    for n in range(1, 5):
+        grams = filtered_ngram(titles, n)
+        assert engine.counts(n, ['fisher']) == list(Counter(grams).items())
+        for k in (None, 0, 1, 5, 20):
+            assert engine.most_common(n, k, ['fisher']) == counter(grams, k)
+            assert engine.most_common(n, k, ['yates']) == counter(filtered_ngram(titles[::7], n), k)
+    assert list(titles_ngram_analysis(titles, 2, most_used=0)) == []
+    assert engine.most_common(2, 10) == counter(filtered_ngram(titles, 2) + filtered_ngram(titles[::7], 2), 10)
+    # every n-gram of yates is one of fisher's too, so they have the same idf and rank by tf-idf like by count
+    assert [g for g, _ in engine.tfidf(2, 5)['yates']] == [g for g, _ in counter(filtered_ngram(titles[::7], 2), 5)]
+
+
+def check_table():
+    # PublicationTable gives back the rows it was made of, the citations as GS shows them, even when the
+    # browser puts the * of merged citations on a line of its own; its analyses are those of the rows
+    link = 'https://scholar.google.com/citations?view_op=view_citation&hl=en&user=FIXTURE0AAAAJ&citation_for_view='
+    rows = [
+        ('The design of experiments', link + 'FIXTURE0AAAAJ:a', 'RA Fisher', '26480\n*', '1935', 'Oliver and Boyd'),
+        ('Statistical methods for research workers', link + 'FIXTURE0AAAAJ:b', 'RA Fisher, F Yates', '1520*',
+         '1925', 'Oliver and Boyd'),
+        ('On the mathematical foundations', link + 'FIXTURE0AAAAJ:c', 'F Yates, R. A. Fisher, ...', '87', '', ''),
+        ('Untitled', link + 'FIXTURE0AAAAJ:d', 'F Yates', '', '1922', 'Biometrika')
+    ] + list(synthetic_profile(300)['publications'])
+    table = PublicationTable(rows)
+    expected = [row[:3] + (row[3].replace('\n', ''),) + row[4:] for row in rows]
+    assert list(table) == expected and list(PublicationTable(table)) == expected
+    assert list(table.citations[:4]) == [26480, 1520, 87, -1] and list(table.starred[:4]) == [1, 1, 0, 0]
+    assert table.authors(2) == ['F Yates', 'R. A. Fisher', '...']
+    assert table.num_of_pub_by_year() == num_of_pub_by_year([row[4] for row in rows])
+    assert table.authors_analysis('Ronald A. Fisher') == authors_analysis([row[2] for row in rows], 'Ronald A. Fisher')
+    assert authors_analysis([row[2] for row in rows[:4]], 'Ronald A. Fisher')[:4] == [
+        ('Which author', 'Count'), ('#_1', 2), ('#_2', 1), ('#_N/A', 1)]
+    # the names without Latin letters are matched whole, and '...' is nobody
+    assert authors_analysis(['张三, 李四, ...', '王小明, 张三'], '王小明')[:3] == [
+        ('Which author', 'Count'), ('#_N/A', 1), ('#_1', 1)]
+
+
+def check_graph():
+    # CoauthorGraph: a paper on two homepages counts once, two papers with the same title do not; the queries
+    # give the same answers once the graph is loaded back from the GSDatabase
+    def profile(name, user, publications):
+        url = f'https://scholar.google.com/citations?user={user}&hl=en'
+        link = 'https://scholar.google.com/citations?view_op=view_citation&hl=en&citation_for_view=' + user
+        return {'info': [name, '', '', url, '', '', '', '2021-04-27'],
+                'publications': [(title, f'{link}:{i}', authors, '1', year, '')
+                                 for i, (title, authors, year) in enumerate(publications)]}
+
+    profiles = [
+        profile('Ronald A. Fisher', 'FISHER', [('The design of experiments', 'RA Fisher, F Yates', '1935'),
+                                               ('Editorial', 'RA Fisher', '1950'),
+                                               ('Statistical tables', 'RA Fisher, F Yates, WG Cochran', '1938')]),
+        profile('Frank Yates', 'YATES', [('Statistical  Tables', 'R. A. Fisher, Frank Yates, W. G. Cochran', '1938'),
+                                         ('Editorial', 'F Yates, JW Tukey', '1960'),
+                                         ('Sampling methods', 'F Yates, WG Cochran', '1949')]),
+        profile('John W. Tukey', 'TUKEY', [('Exploratory data analysis', 'JW Tukey', '1977'),
+                                           ('Editorial', 'F Yates, JW Tukey', '1960')]),
+        profile('王小明', 'WANG', [('数理统计', '王小明, 张三', '1990')]),
+        profile('李四', 'LI', [('抽样调查', '李四, ...', '1991')])
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        db = GSDatabase(os.path.join(tmp, 'graph.sqlite'))
+        graph = CoauthorGraph(db)
+        for p in profiles:
+            graph.add_profile(p)
+        for graph in (graph, CoauthorGraph(db)):
+            assert len(graph.pubs) == 8 and len(graph.scholars) == 5
+            assert graph.coauthors('FISHER') == [('Frank Yates', 2), ('WG Cochran', 1)]
+            assert graph.coauthors('John W. Tukey') == [('Frank Yates', 1)]
+            assert graph.publications('YATES') == ['the design of experiments', 'statistical tables', 'editorial',
+                                                   'sampling methods']
+            assert graph.shared_collaborators('FISHER', 'TUKEY') == [('Frank Yates', 2, 1)]
+            assert graph.neighbourhood('TUKEY') == {'Frank Yates': 1}
+            assert graph.neighbourhood('TUKEY', k=2) == {'Ronald A. Fisher': 2, 'Frank Yates': 1, 'WG Cochran': 2}
+            # the scholars without Latin letters in their names are not one and the same
+            assert graph.coauthors('WANG') == [('张三', 1)] and graph.coauthors('LI') == []
+        db.close()
+
+
+def check_resolver():
+    # AuthorResolver picks the namesake whose affiliation matches the hint, leaves the others ambiguous, and
+    # saves what it resolved so that it is not searched again, even by another resolver
+    server = serve_fixtures()
+    host = f'http://127.0.0.1:{server.server_port}'
+    _, (ucl, mit) = search_gs_authors('Ronald A. Fisher', host=host)
+    assert AuthorResolver.score(ucl, 'Ronald A. Fisher', 'University College London') == 3
+    assert AuthorResolver.score(mit, 'Ronald A. Fisher', 'University College London') == 1
+    assert AuthorResolver.score(mit, 'RA Fisher', 'MIT physics') > AuthorResolver.score(ucl, 'RA Fisher', 'MIT physics')
+    queries = ['Claude E Shannon', ('Ronald A. Fisher', 'University College London'), ('Ronald A. Fisher', 'Harvard'),
+               'Ronald A. Fisher', 'Nobody at all']
+    with tempfile.TemporaryDirectory() as tmp:
+        db = GSDatabase(os.path.join(tmp, 'resolutions.sqlite'))
+        metrics = Metrics()
+        resolver = AuthorResolver(database=db, host=host, metrics=metrics)
+        assert resolver.pick([ucl, mit], 'Ronald A. Fisher', 'ucl.ac.uk statistics') is ucl
+        assert resolver.pick([ucl, mit], 'Ronald A. Fisher') is None
+        resolutions = resolver.resolve(queries)
+        assert [r.status for r in resolutions] == ['resolved', 'resolved', 'ambiguous', 'ambiguous', 'not found']
+        assert resolutions[0].url.endswith('user=SHANNON1AAAJ') and resolutions[1].url == ucl.url
+        assert len(resolutions[2].candidates) == 2 and metrics.counters['requests'] == 5
+        resolver.close()
+        # the same queries (up to case and spaces) with a new resolver: only the unresolved ones are searched
+        resolver = AuthorResolver(database=db, host=host, metrics=metrics)
+        resolutions = resolver.resolve(['claude  e shannon', ('Ronald A. Fisher', 'university college london'),
+                                        'Ronald A. Fisher'])
+        assert [r.status for r in resolutions] == ['known', 'known', 'ambiguous']
+        assert resolutions[1].url == ucl.url and metrics.counters['requests'] == 6
+        resolver.close()
+        db.close()
+
+        # gs_profiles_generators_by_queries: a BatchResult per query, in order, the unresolved ones included.
+        # The session given is not closed with the GSAnalyzer
+        session, closed = gs_session(), []
+        session.close = lambda: closed.append(session)
+        g = GSAnalyzer(None, tmp, backend='http', session=session)
+        results = g.gs_profiles_generators_by_queries(
+            ['Nobody at all', 'Claude E Shannon', ('Ronald A. Fisher', 'Harvard'), ('Ronald A. Fisher', 'ucl')],
+            add2database=False, host=host)
+        assert [r.item for r in results] == ['Nobody at all', 'Claude E Shannon', ('Ronald A. Fisher', 'Harvard'),
+                                             ('Ronald A. Fisher', 'ucl')]
+        assert [type(r.error) for r in results] == [LookupError, type(None), LookupError, type(None)]
+        assert results[1].url.endswith('user=SHANNON1AAAJ') and os.path.exists(results[1].path)
+        assert results[3].url == ucl.url and os.path.exists(results[3].path) and not closed
+        g = GSAnalyzer(None, tmp, backend='http')
+        [result] = g.gs_profiles_generators_by_queries('Claude E Shannon', add2database=False, host=host)
+        assert result.item == 'Claude E Shannon' and result.path == results[1].path
+    server.shutdown()
+
+
+def check_async():
+    # AsyncGSAnalyzer against the fixture server: the same profile as GSAnalyzer with the http backend, a batch
+    # with a homepage not found, the author search, the per-request timeout and the cancellation
+    server = serve_fixtures(250)
+    host = f'http://127.0.0.1:{server.server_port}'
+    urls = [f'{host}/citations?user=FIXTURE{i:02d}AAAJ&hl=en' for i in range(6)] + \
+        [f'{host}/citations?user=MISSING0AAAJ&hl=en']
+    detail = f'{host}/citations?view_op=view_citation&hl=en&citation_for_view=FIXTURE0AAAAJ:000001'
+
+    async def run(res_dir, graph):
+        async with AsyncGSAnalyzer(res_dir, concurrency=4, retries=0, graph=graph) as g:
+            profile = await g.fetch_profile(urls[0])
+            results = await g.gs_profiles_generators_by_urls(urls, add2database=False, output='jsonl')
+            found = [await gshp_link_by_query_async(query, g, host=host) for query in ('Claude Shannon', 'RA Fisher')]
+        server.latency = 1
+        async with AsyncGSAnalyzer(res_dir, timeout=0.2, retries=0) as g:
+            try:
+                await g.get(detail)
+                timed_out = False
+            except asyncio.TimeoutError:
+                timed_out = True
+            task = asyncio.ensure_future(g.get(detail))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            try:
+                await task
+                cancelled = False
+            except asyncio.CancelledError:
+                cancelled = True
+        server.latency = 0
+        return profile, results, found, timed_out, cancelled
+
+    g = GSAnalyzer(None, '.', backend='http')
+    g.loading_gs_homepage(urls[0])
+    expected = g.extract_profile()
+    g.close()
+    with tempfile.TemporaryDirectory() as tmp:
+        graph = CoauthorGraph()
+        profile, results, found, timed_out, cancelled = asyncio.run(run(tmp, graph))
+        assert profile['info'] == expected['info'] and profile['citation_by_year'] == expected['citation_by_year']
+        assert list(profile['publications']) == list(expected['publications'])
+        assert [r.url for r in results] == urls and all(os.path.exists(r.path) for r in results[:-1])
+        assert len({r.path for r in results[:-1]}) == 6
+        assert results[-1].path is None and getattr(results[-1].error, 'status', None) == 404
+        # every profile was added to the graph from the executor's threads
+        assert len(graph.scholars) == 6 and len(graph.publications('RA Fisher')) == 250
+    assert found == [f'{host}/citations?hl=en&user=SHANNON1AAAJ', None]
+    assert timed_out and cancelled
+    server.shutdown()
+
+
+def check_resume():
+    # A batch run with a JobQueue by another process is killed part way through and resumed here: every url
+    # is written once, the url not found fails after max_attempts attempts, and is done by retry_failed once it
+    # is found. A url that failed is claimed again after the others, once its backoff is over
+    server = serve_fixtures(250)
+    server.page_latency = 0.2
+    host = f'http://127.0.0.1:{server.server_port}'
+    urls = [f'{host}/citations?user=FIXTURE{i:02d}AAAJ&hl=en' for i in range(8)] + \
+        [f'{host}/citations?user=MISSING0AAAJ&hl=en']
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'jobs.sqlite')
+        script = ('import sys; from GSAnalyzer import JobQueue, gs_profiles_pipeline; '
+                  'gs_profiles_pipeline(sys.argv[3:], sys.argv[1], workers=1, rate=None, retries=0, '
+                  'add2database=False, output="jsonl", jobs=JobQueue(sys.argv[2], backoff=0.05))')
+        worker = subprocess.Popen([sys.executable, '-c', script, tmp, path] + urls,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)))
+        queue = None
+        while queue is None or queue.counts().get('written', 0) < 2:
+            time.sleep(0.05)
+            assert worker.poll() is None, 'the batch was over before it could be killed'
+            queue = queue or (JobQueue(path) if os.path.exists(path) else None)
+        worker.kill()
+        worker.wait()
+        queue.close()
+
+        # the urls held by the dead process are released when the queue is opened again
+        queue = JobQueue(path, backoff=0.05)
+        written = queue.counts()['written']
+        assert 2 <= written < 8
+        metrics = Metrics()
+        results = resume(queue, tmp, workers=2, rate=None, retries=0, add2database=False, output='jsonl',
+                         metrics=metrics)
+        assert metrics.counters['profiles'] == 8 - written
+        assert queue.counts() == {'written': 8, 'failed': 1} and [r.url for r in results] == urls
+        assert len({r.path for r in results[:-1]}) == 8 and all(os.path.exists(r.path) for r in results[:-1])
+        assert results[-1].path is None and '404' in str(results[-1].error)
+        assert queue.db.execute('SELECT attempts FROM jobs WHERE url = ?', (urls[-1],)).fetchone()[0] == 3
+        server.missing = None
+        queue.retry_failed()
+        results = resume(queue, tmp, workers=2, rate=None, retries=0, add2database=False, output='jsonl',
+                         metrics=metrics)
+        assert queue.counts() == {'written': 9} and os.path.exists(results[-1].path)
+        assert metrics.counters['profiles'] == 9 - written
+        queue.close()
+
+        queue = JobQueue(os.path.join(tmp, 'backoff.sqlite'), backoff=0.3)
+        queue.add(['a', 'b', 'c'])
+        queue.fail(queue.claim().url, ConnectionError())
+        assert [queue.claim().url, queue.claim().url, queue.claim(wait=False)] == ['b', 'c', None]
+        queue.advance('b', 'written', path='b')
+        queue.advance('c', 'written', path='c')
+        start = time.perf_counter()
+        job = queue.claim()
+        assert job.url == 'a' and job.attempts == 2 and time.perf_counter() - start > 0.2
+        queue.close()
+    server.shutdown()
+
+
+def run_checks():
+    for check in [check_cache, check_database, check_refresh, check_ngrams, check_table, check_graph, check_resolver,
+                  check_async, check_resume]:
+        check()
+        print(f'{check.__name__}: ok')
+
+
+def run_suite():
+    # Every benchmark, as {name: seconds}
+    results = {}
+    for mode, (calls, seconds, _) in bench_extraction().items():
+        results[f'extraction.{mode}'] = seconds
+    results['loading'] = bench_loading()[1]
+    for name, (seconds, _) in bench_details().items():
+        results[f'details.{name}'] = seconds
+    for name, seconds in bench_analysis().items():
+        results[f'analysis.{name}'] = seconds
+    results['cohort.load'], results['cohort.metrics'] = bench_cohort()
+    for name, (seconds, _, _) in bench_writers().items():
+        results[f'writers.{name}'] = seconds
+    seconds, metrics = bench_pipeline()
+    results['pipeline'] = seconds
+    for name, stage in metrics['stages'].items():
+        results[f'pipeline.{name}'] = stage['seconds']
+    return results
+
+
+def compare(results, baseline, tolerance=1.5):
+    # The benchmarks more than `tolerance` times slower than the baseline, as {name: (baseline, now)}
+    return {name: (baseline[name], seconds) for name, seconds in results.items()
+            if name in baseline and seconds > baseline[name] * tolerance}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks for GSAnalyzer')
+    parser.add_argument('--save', help='save the timings as json')
+    parser.add_argument('--baseline', help='compare the timings with the ones saved by --save')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='how many times slower than the baseline a benchmark may be (default: 1.5)')
+    parser.add_argument('--check', action='store_true', help='run the checks instead of the benchmarks')
+    args = parser.parse_args()
+
+    if args.check:
+        run_checks()
+        sys.exit()
+    results = run_suite()
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, (before, now) in regressions.items():
+            print(f'Regression in {name}: {before:.3f} s -> {now:.3f} s')
+        if regressions:
+            sys.exit(1)
+        print(f'No regression (tolerance: {args.tolerance})')